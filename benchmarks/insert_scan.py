@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the bulk scan insertion against the per-region ORM insertion on a synthetic scan. The
+insertions are rolled back, but the database described by the `POSTGIS_*` environment variables must
+have been created with `create-database`.
+"""
+
+import argparse
+import time
+
+import numpy as np
+from geoalchemy2.functions import ST_GeomFromEWKT
+from sqlalchemy import LargeBinary, bindparam, func, select
+from sqlalchemy.orm import Session
+
+from brain_region_database.database.engine import get_engine
+from brain_region_database.database.geometry import create_point_ewkb, create_polyhedral_surface_ewkb
+from brain_region_database.database.models import DBScan, DBScanRegion
+from brain_region_database.database.query import (
+    create_box,
+    create_point,
+    create_postgis_3d_geometry,
+    insert_scans,
+)
+from brain_region_database.scan import Point3D, Scan, ScanRegion
+
+
+def create_synthetic_scan(file_name: str, region_count: int, face_count: int, seed: int = 0) -> Scan:
+    rng = np.random.default_rng(seed)
+
+    regions: list[ScanRegion] = []
+    for value in range(1, region_count + 1):
+        vertices = rng.uniform(-100, 100, size=(face_count // 2 + 2, 3))
+        faces = rng.integers(0, len(vertices), size=(face_count, 3))
+        regions.append(ScanRegion(
+            name=f"Region {value}",
+            value=value,
+            voxel_count=face_count,
+            mean_intensity=1.0,
+            std_intensity=1.0,
+            min_intensity=0.0,
+            max_intensity=2.0,
+            median_intensity=1.0,
+            centroid=Point3D.from_array(vertices.mean(axis=0)),
+            bounding_box=(Point3D.from_array(vertices.min(axis=0)), Point3D.from_array(vertices.max(axis=0))),
+            shape=(vertices, faces),
+        ))
+
+    return Scan(
+        file_name=file_name,
+        file_size=0,
+        dimensions="0x0x0",
+        voxel_size="1.00x1.00x1.00mm",
+        regions=regions,
+    )
+
+
+def insert_scan_orm(db: Session, scan: Scan):
+    """
+    Reference implementation, with one ORM object per region.
+    """
+
+    db_scan = DBScan(
+        file_name=scan.file_name,
+        file_size=scan.file_size,
+        dimensions=scan.dimensions,
+        voxel_size=scan.voxel_size,
+    )
+
+    db.add(db_scan)
+    db.flush()
+
+    for region in scan.regions:
+        db.add(DBScanRegion(
+            scan_id=db_scan.id,
+            name=region.name,
+            value=region.value,
+            voxel_count=region.voxel_count,
+            mean_intensity=region.mean_intensity,
+            std_intensity=region.std_intensity,
+            min_intensity=region.min_intensity,
+            max_intensity=region.max_intensity,
+            median_intensity=region.median_intensity,
+            centroid=ST_GeomFromEWKT(f"SRID=4326;{create_point(region.centroid)}"),
+            bounding_box=ST_GeomFromEWKT(f"SRID=4326;{create_box(region.bounding_box)}"),
+            shape=ST_GeomFromEWKT(
+                f"SRID=4326;{create_postgis_3d_geometry(region.shape[0].tolist(), region.shape[1].tolist())}"
+            ),
+        ))
+
+    db.flush()
+
+
+def check_same_geometries(db: Session, region: ScanRegion):
+    """
+    Check that the binary geometries of a region are identical to its text geometries once parsed by
+    the database.
+    """
+
+    def is_same_geometry(text: str, binary: bytes) -> bool:
+        return db.scalar(select(
+            func.ST_AsEWKB(ST_GeomFromEWKT(text)) == func.ST_AsEWKB(
+                func.ST_GeomFromEWKB(bindparam('binary', binary, type_=LargeBinary))
+            )
+        ))
+
+    vertices, faces = region.shape
+
+    assert is_same_geometry(f"SRID=4326;{create_point(region.centroid)}", create_point_ewkb(region.centroid))
+    assert is_same_geometry(
+        f"SRID=4326;{create_postgis_3d_geometry(vertices.tolist(), faces.tolist())}",
+        create_polyhedral_surface_ewkb(vertices, faces),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the scan insertion in the database.")
+
+    parser.add_argument('--regions',
+        type=int,
+        default=100,
+        help="The number of regions of the synthetic scan.")
+
+    parser.add_argument('--faces',
+        type=int,
+        default=1000,
+        help="The number of faces of each region of the synthetic scan.")
+
+    args = parser.parse_args()
+
+    scan = create_synthetic_scan('benchmark.nii', args.regions, args.faces)
+
+    with Session(get_engine()) as db:
+        check_same_geometries(db, scan.regions[0])
+
+        start = time.perf_counter()
+        insert_scan_orm(db, scan)
+        orm_time = time.perf_counter() - start
+        db.rollback()
+
+        start = time.perf_counter()
+        insert_scans(db, [scan])
+        db.flush()
+        bulk_time = time.perf_counter() - start
+        db.rollback()
+
+    print(f"Scan: {args.regions} regions of {args.faces} faces")
+    print(f"ORM insertion:  {orm_time:.3f}s")
+    print(f"Bulk insertion: {bulk_time:.3f}s")
+    print(f"Speedup:        {orm_time / bulk_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the single-pass label statistics against the per-region loop on a synthetic labelled volume.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from brain_region_database.process.statistics import LabelStatistics, compute_label_statistics
+
+
+def create_phantom(size: int, label_count: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Create a label volume made of random blocks and a matching random intensity volume.
+    """
+
+    rng = np.random.default_rng(seed)
+    block_size = max(1, size // int(np.ceil(label_count ** (1 / 3))))
+    block_labels = rng.integers(0, label_count + 1, size=(-(-size // block_size),) * 3)
+    labels = np.kron(block_labels, np.ones((block_size,) * 3, dtype=np.int64))[:size, :size, :size]
+    data = rng.normal(100, 20, size=(size, size, size))
+    return labels.astype(np.float64), data
+
+
+def compute_label_statistics_loop(
+    labels: np.ndarray,
+    data: np.ndarray,
+    values: list[int],
+) -> dict[int, LabelStatistics]:
+    """
+    Reference implementation, with one full-volume pass per label.
+    """
+
+    statistics: dict[int, LabelStatistics] = {}
+    for value in values:
+        mask = (labels == value)
+        coordinates = np.argwhere(mask)
+        if len(coordinates) == 0:
+            continue
+
+        intensities = data[mask]
+        statistics[value] = LabelStatistics(
+            value=value,
+            voxel_count=np.sum(mask).item(),
+            mean_intensity=np.mean(intensities).item(),
+            std_intensity=np.std(intensities).item(),
+            min_intensity=np.min(intensities).item(),
+            max_intensity=np.max(intensities).item(),
+            median_intensity=np.median(intensities).item(),
+            centroid=np.mean(coordinates, axis=0),
+            bounding_box=(np.min(coordinates, axis=0), np.max(coordinates, axis=0)),
+        )
+
+    return statistics
+
+
+def check_same_statistics(expected: dict[int, LabelStatistics], actual: dict[int, LabelStatistics]):
+    assert expected.keys() == actual.keys()
+    for value, statistics in expected.items():
+        other = actual[value]
+        assert statistics.voxel_count      == other.voxel_count
+        assert statistics.mean_intensity   == other.mean_intensity
+        assert statistics.std_intensity    == other.std_intensity
+        assert statistics.min_intensity    == other.min_intensity
+        assert statistics.max_intensity    == other.max_intensity
+        assert statistics.median_intensity == other.median_intensity
+        assert np.array_equal(statistics.centroid, other.centroid)
+        assert np.array_equal(statistics.bounding_box[0], other.bounding_box[0])
+        assert np.array_equal(statistics.bounding_box[1], other.bounding_box[1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the label statistics computation.")
+
+    parser.add_argument('--size',
+        type=int,
+        default=128,
+        help="The size of each side of the synthetic volume.")
+
+    parser.add_argument('--labels',
+        type=int,
+        default=100,
+        help="The number of labels of the synthetic volume.")
+
+    args = parser.parse_args()
+
+    labels, data = create_phantom(args.size, args.labels)
+    values = list(range(1, args.labels + 1))
+
+    start = time.perf_counter()
+    expected = compute_label_statistics_loop(labels, data, values)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = compute_label_statistics(labels, data, values)
+    grouped_time = time.perf_counter() - start
+
+    check_same_statistics(expected, actual)
+
+    print(f"Volume: {args.size}^3 voxels, {len(actual)} labels")
+    print(f"Per-region loop: {loop_time:.3f}s")
+    print(f"Single pass:     {grouped_time:.3f}s")
+    print(f"Speedup:         {loop_time / grouped_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of each stage of the scan analysis pipeline on synthetic labelled volumes of several sizes
+and label counts. Each stage is timed and memory-profiled on its own, and the results can be written
+as JSON to compare runs.
+"""
+
+import argparse
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+import nibabel as nib
+import numpy as np
+from label_statistics import create_phantom
+from nibabel.nifti1 import Nifti1Image
+
+from brain_region_database.database.geometry import create_polyhedral_surface_ewkb
+from brain_region_database.database.query import create_postgis_3d_geometry
+from brain_region_database.nifti import load_nifti_image
+from brain_region_database.process.orientation import reorient_nifti
+from brain_region_database.process.size import resize_nifti
+from brain_region_database.process.statistics import LabelStatistics, compute_label_statistics
+from brain_region_database.process.transform import (
+    create_reference_transform,
+    create_resize_transform,
+    get_image_grid,
+    resample_nifti,
+)
+from brain_region_database.process.vectorization import (
+    DEFAULT_MESH_LEVELS,
+    compute_mesh_levels,
+    compute_nifti_mask_mesh,
+)
+from brain_region_database.scan import Point3D, Scan, ScanRegion, ScanRegionLevel
+
+type MeshArrays = tuple[np.ndarray, np.ndarray]
+
+type MeshLevel = tuple[float, np.ndarray, np.ndarray]
+
+
+@dataclass
+class StageResult:
+    stage: str
+    size: int
+    labels: int
+    seconds: float
+    peak_memory: int
+
+
+def measure(function: Callable[[], Any], repeat: int) -> tuple[Any, float, int]:
+    """
+    Run a function several times and return its result, its best wall time, and the peak memory
+    allocated by a separate traced run, so that the tracing does not slow down the timed runs.
+    """
+
+    best_time = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best_time = min(best_time, time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, best_time, peak_memory
+
+
+def create_rotated_reference(image: Nifti1Image, shape: tuple[int, int, int], angle: float) -> Nifti1Image:
+    """
+    Create an empty reference image with a given shape, whose grid is rotated around the first axis
+    and covers the same extent as an image.
+    """
+
+    cos, sin = np.cos(angle), np.sin(angle)
+    rotation = np.array([
+        [1, 0,    0,   0],
+        [0, cos, -sin, 0],
+        [0, sin,  cos, 0],
+        [0, 0,    0,   1],
+    ])
+
+    scale = np.diag([*(np.array(image.shape[:3]) / np.array(shape)), 1])
+    affine = rotation @ image.affine @ scale  # type: ignore
+    return Nifti1Image(np.zeros(shape, dtype=np.uint8), affine)
+
+
+def create_region(
+    value: int,
+    statistics: LabelStatistics,
+    mesh: MeshArrays,
+    levels: list[MeshLevel],
+) -> ScanRegion:
+    vertices, faces = mesh
+    return ScanRegion(
+        name=f"Region {value}",
+        value=value,
+        voxel_count=statistics.voxel_count,
+        mean_intensity=statistics.mean_intensity,
+        std_intensity=statistics.std_intensity,
+        min_intensity=statistics.min_intensity,
+        max_intensity=statistics.max_intensity,
+        median_intensity=statistics.median_intensity,
+        centroid=Point3D.from_array(statistics.centroid),
+        bounding_box=(
+            Point3D.from_array(statistics.bounding_box[0]),
+            Point3D.from_array(statistics.bounding_box[1]),
+        ),
+        shape=(vertices, faces),
+        levels=[
+            ScanRegionLevel(ratio=ratio, shape=(level_vertices, level_faces))
+            for ratio, level_vertices, level_faces in levels
+        ],
+    )
+
+
+def benchmark_phantom(size: int, label_count: int, repeat: int, directory: Path) -> list[StageResult]:
+    """
+    Benchmark each stage of the pipeline on a synthetic volume, feeding the output of each stage to
+    the next one.
+    """
+
+    results: list[StageResult] = []
+
+    def run(stage: str, function: Callable[[], Any]) -> Any:
+        result, seconds, peak_memory = measure(function, repeat)
+        results.append(StageResult(stage, size, label_count, seconds, peak_memory))
+        print(f"{size:>5}^3 {label_count:>6} {stage:<16} {seconds:>9.3f}s {peak_memory / 1024 ** 2:>10.1f}MiB")
+        return result
+
+    labels, data = create_phantom(size, label_count)
+    values = list(range(1, label_count + 1))
+    affine = np.diag([1.0, 1.0, 1.0, 1.0])
+
+    scan_path = directory / f'phantom_{size}_{label_count}.nii'
+    nib.save(Nifti1Image(data.astype(np.float32), affine), scan_path)  # type: ignore
+    labels_image = Nifti1Image(labels, affine)
+
+    scan_image = run('load', lambda: load_nifti_image(scan_path))
+    run('load_data', lambda: scan_image.get_fdata(caching='unchanged'))
+
+    reference = create_rotated_reference(scan_image, scan_image.shape[:3], 0.1)
+    half_reference = create_rotated_reference(scan_image, (size // 2,) * 3, 0.0)
+
+    run('reorient', lambda: reorient_nifti(scan_image, reference, 'continuous'))
+    run('resize', lambda: resize_nifti(scan_image, half_reference, 'continuous'))
+
+    def resample_fused():
+        reorient_transform = create_reference_transform(get_image_grid(scan_image), reference)
+        resize_transform   = create_resize_transform(reorient_transform.grid, half_reference)
+        return resample_nifti(scan_image, [reorient_transform, resize_transform], 1, np.dtype(np.float32))
+
+    run('resample_fused', resample_fused)
+
+    statistics: dict[int, LabelStatistics] = run(
+        'statistics',
+        lambda: compute_label_statistics(labels, data, values),
+    )
+
+    meshes: dict[int, MeshArrays] = run('meshing', lambda: {
+        value: compute_nifti_mask_mesh(labels_image, labels, value, region_statistics.bounding_box)
+        for value, region_statistics in statistics.items()
+    })
+
+    levels: dict[int, list[MeshLevel]] = run('simplification', lambda: {
+        value: compute_mesh_levels(vertices, faces, DEFAULT_MESH_LEVELS)
+        for value, (vertices, faces) in meshes.items()
+    })
+
+    run('geometry_text', lambda: [
+        create_postgis_3d_geometry(vertices.tolist(), faces.tolist()) for vertices, faces in meshes.values()
+    ])
+
+    run('geometry_binary', lambda: [
+        create_polyhedral_surface_ewkb(vertices, faces) for vertices, faces in meshes.values()
+    ])
+
+    scan: Scan = run('scan_model', lambda: Scan(
+        file_name=scan_path.name,
+        file_size=scan_path.stat().st_size,
+        dimensions='x'.join(str(dimension) for dimension in scan_image.shape),
+        voxel_size="1.00x1.00x1.00mm",
+        regions=[
+            create_region(value, statistics[value], mesh, levels[value]) for value, mesh in meshes.items()
+        ],
+    ))
+
+    run('serialization', lambda: scan.model_dump_json())
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the scan analysis pipeline.")
+
+    parser.add_argument('--sizes',
+        type=int,
+        nargs='+',
+        default=[64, 128],
+        help="The sizes of each side of the synthetic volumes.")
+
+    parser.add_argument('--labels',
+        type=int,
+        nargs='+',
+        default=[10, 100],
+        help="The numbers of labels of the synthetic volumes.")
+
+    parser.add_argument('--repeat',
+        type=int,
+        default=3,
+        help="The number of timed runs of each stage, of which the best time is kept.")
+
+    parser.add_argument('--output',
+        type=Path,
+        help="A JSON file in which to write the results.")
+
+    args = parser.parse_args()
+
+    results: list[StageResult] = []
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'Size':>7} {'Labels':>6} {'Stage':<16} {'Time':>10} {'Peak memory':>13}")
+        for size in args.sizes:
+            for label_count in args.labels:
+                results.extend(benchmark_phantom(size, label_count, args.repeat, Path(directory)))
+
+    if args.output is not None:
+        args.output.write_text(json.dumps({
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'repeat': args.repeat,
+            'results': [asdict(result) for result in results],
+        }, indent=2))
+
+        print(f"Results written to '{args.output}'.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import math
+from typing import Any
+
+from sqlalchemy import ColumnElement, Select, bindparam, delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from brain_region_database.database.models import DBRegionAggregate, DBScanRegion
+
+# Scan region statistics aggregated in the region aggregates.
+AGGREGATED_STATISTICS = (
+    'voxel_count',
+    'mean_intensity',
+    'std_intensity',
+    'min_intensity',
+    'max_intensity',
+    'median_intensity',
+)
+
+
+def select_region_aggregates(db: Session) -> list[DBRegionAggregate]:
+    return list(db.scalars(select(DBRegionAggregate).order_by(DBRegionAggregate.value)).all())
+
+
+def compute_aggregate_mean_std(aggregate: DBRegionAggregate, statistic: str) -> tuple[float, float]:
+    """
+    Compute the mean and the population standard deviation of a statistic over all the scan regions
+    of a region aggregate.
+    """
+
+    total         = getattr(aggregate, f'{statistic}_sum')
+    total_squares = getattr(aggregate, f'{statistic}_sum_squares')
+
+    mean     = total / aggregate.count
+    variance = max(total_squares / aggregate.count - mean ** 2, 0.0)
+    return mean, math.sqrt(variance)
+
+
+def update_region_aggregates(db: Session, scan_ids: list[int]):
+    """
+    Add the regions of newly inserted scans to the region aggregates. The transaction is not
+    committed.
+    """
+
+    if scan_ids == []:
+        return
+
+    query = insert(DBRegionAggregate).from_select(
+        get_aggregate_columns(),
+        select_scan_region_aggregates().where(DBScanRegion.scan_id.in_(scan_ids)),
+    )
+
+    excluded = query.excluded
+    values: dict[str, Any] = {'count': DBRegionAggregate.count + excluded['count']}
+    for statistic in AGGREGATED_STATISTICS:
+        for suffix in ('sum', 'sum_squares'):
+            column = f'{statistic}_{suffix}'
+            values[column] = getattr(DBRegionAggregate, column) + excluded[column]
+
+        min_column = f'{statistic}_min'
+        max_column = f'{statistic}_max'
+        values[min_column] = func.least(getattr(DBRegionAggregate, min_column), excluded[min_column])
+        values[max_column] = func.greatest(getattr(DBRegionAggregate, max_column), excluded[max_column])
+
+    db.execute(query.on_conflict_do_update(index_elements=['name', 'value'], set_=values))
+
+
+def subtract_region_aggregates(db: Session, scan_ids: list[int]) -> list[str]:
+    """
+    Remove the regions of scans that are about to be deleted from the region aggregates, by
+    subtracting their counts and sums. Return the names of the regions whose aggregates must be
+    rebuilt once the scans are deleted, because a removed region holds the minimum or maximum of one
+    of their statistics, or was their last region. The transaction is not committed.
+    """
+
+    if scan_ids == []:
+        return []
+
+    columns = get_aggregate_columns()
+
+    removed_aggregates = [
+        dict(zip(columns, row))
+        for row in db.execute(select_scan_region_aggregates().where(DBScanRegion.scan_id.in_(scan_ids))).tuples()
+    ]
+
+    if removed_aggregates == []:
+        return []
+
+    # Select the columns rather than the aggregate objects, which are updated without the ORM below.
+    stored_rows = db.execute(
+        select(*(getattr(DBRegionAggregate, column) for column in columns))
+            .where(DBRegionAggregate.name.in_({aggregate['name'] for aggregate in removed_aggregates}))
+    ).tuples()
+
+    stored_aggregates = {(row[0], row[1]): dict(zip(columns, row)) for row in stored_rows}
+
+    rebuilt_names: set[str] = set()
+    subtracted_rows: list[dict[str, Any]] = []
+    for removed in removed_aggregates:
+        stored = stored_aggregates.get((removed['name'], removed['value']))
+        if stored is None or stored['count'] <= removed['count'] or any(
+            stored[f'{statistic}_{bound}'] == removed[f'{statistic}_{bound}']
+            for statistic in AGGREGATED_STATISTICS
+            for bound in ('min', 'max')
+        ):
+            rebuilt_names.add(removed['name'])
+            continue
+
+        subtracted_rows.append({
+            'region_name':  removed['name'],
+            'region_value': removed['value'],
+            **{f'removed_{column}': removed[column] for column in get_subtracted_columns()},
+        })
+
+    if subtracted_rows != []:
+        table = DBRegionAggregate.__table__
+        values = {column: table.c[column] - bindparam(f'removed_{column}') for column in get_subtracted_columns()}
+        db.execute(
+            update(table)
+                .where(table.c.name == bindparam('region_name'), table.c.value == bindparam('region_value'))
+                .values(values),
+            subtracted_rows,
+        )
+
+    return sorted(rebuilt_names)
+
+
+def rebuild_region_aggregates(db: Session, region_names: list[str] | None = None):
+    """
+    Rebuild the region aggregates from the scan regions, either all of them or only those of the
+    given regions. This is needed when deleted scan regions held the minimum or maximum of a region,
+    as these cannot be updated incrementally. The transaction is not committed.
+    """
+
+    delete_query = delete(DBRegionAggregate)
+    aggregate_query = select_scan_region_aggregates()
+    if region_names is not None:
+        delete_query    = delete_query.where(DBRegionAggregate.name.in_(region_names))
+        aggregate_query = aggregate_query.where(DBScanRegion.name.in_(region_names))
+
+    db.execute(delete_query)
+    db.execute(insert(DBRegionAggregate).from_select(get_aggregate_columns(), aggregate_query))
+
+
+def select_scan_region_aggregates() -> Select[Any]:
+    columns: list[ColumnElement[Any]] = [DBScanRegion.name, DBScanRegion.value, func.count()]
+    for statistic in AGGREGATED_STATISTICS:
+        column = getattr(DBScanRegion, statistic)
+        columns += [func.sum(column), func.sum(column * column), func.min(column), func.max(column)]
+
+    return select(*columns).group_by(DBScanRegion.name, DBScanRegion.value)
+
+
+def get_aggregate_columns() -> list[str]:
+    columns = ['name', 'value', 'count']
+    for statistic in AGGREGATED_STATISTICS:
+        columns += [f'{statistic}_sum', f'{statistic}_sum_squares', f'{statistic}_min', f'{statistic}_max']
+
+    return columns
+
+
+def get_subtracted_columns() -> list[str]:
+    """
+    Get the aggregate columns that can be updated when scan regions are removed.
+    """
+
+    columns = ['count']
+    for statistic in AGGREGATED_STATISTICS:
+        columns += [f'{statistic}_sum', f'{statistic}_sum_squares']
+
+    return columns
@@ -0,0 +1,71 @@
+import numpy as np
+
+from brain_region_database.scan import Point3D
+
+# Extended WKB geometry types and flags, see the PostGIS `liblwgeom` documentation.
+WKB_POINT               = 1
+WKB_POLYGON             = 3
+WKB_POLYHEDRALSURFACE   = 15
+WKB_Z_FLAG              = 0x80000000
+WKB_SRID_FLAG           = 0x20000000
+WKB_LITTLE_ENDIAN       = 1
+
+# Header of a little-endian extended WKB geometry with a SRID.
+EWKB_HEADER = np.dtype([
+    ('byte_order', 'u1'),
+    ('type',       '<u4'),
+    ('srid',       '<u4'),
+])
+
+# Triangle of a polyhedral surface, as a polygon with a single closed ring of four points.
+WKB_TRIANGLE = np.dtype([
+    ('byte_order',  'u1'),
+    ('type',        '<u4'),
+    ('ring_count',  '<u4'),
+    ('point_count', '<u4'),
+    ('points',      '<f8', (4, 3)),
+])
+
+
+def create_point_ewkb(point: Point3D, srid: int = 4326) -> bytes:
+    """
+    Encode a 3D point as an extended WKB POINT Z.
+    """
+
+    return (
+        create_ewkb_header(WKB_POINT, srid)
+        + np.array([point.x, point.y, point.z], dtype='<f8').tobytes()
+    )
+
+
+def create_polyhedral_surface_ewkb(vertices: np.ndarray, faces: np.ndarray, srid: int = 4326) -> bytes:
+    """
+    Encode a triangle mesh as an extended WKB POLYHEDRALSURFACE Z, with one polygon per face. The
+    geometry is the same as the one of `create_postgis_3d_geometry`.
+    """
+
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    faces    = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+
+    triangles = np.empty(len(faces), dtype=WKB_TRIANGLE)
+    triangles['byte_order']  = WKB_LITTLE_ENDIAN
+    triangles['type']        = WKB_POLYGON | WKB_Z_FLAG
+    triangles['ring_count']  = 1
+    triangles['point_count'] = 4
+    # Close each ring by repeating its first vertex.
+    triangles['points'][:, :3] = vertices[faces]
+    triangles['points'][:, 3]  = vertices[faces[:, 0]]
+
+    return (
+        create_ewkb_header(WKB_POLYHEDRALSURFACE, srid)
+        + np.array([len(faces)], dtype='<u4').tobytes()
+        + triangles.tobytes()
+    )
+
+
+def create_ewkb_header(geometry_type: int, srid: int) -> bytes:
+    header = np.empty(1, dtype=EWKB_HEADER)
+    header['byte_order'] = WKB_LITTLE_ENDIAN
+    header['type']       = geometry_type | WKB_Z_FLAG | WKB_SRID_FLAG
+    header['srid']       = srid
+    return header.tobytes()
@@ -1,8 +1,22 @@
 from geoalchemy2 import Geometry
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, MappedAsDataclass, mapped_column, relationship
 
 
+def create_nd_spatial_index(table_name: str, column_name: str) -> Index:
+    """
+    Create a GiST index on the n-dimensional bounding boxes of a geometry column, which unlike the
+    default 2D spatial index of GeoAlchemy also indexes the Z coordinates.
+    """
+
+    return Index(
+        f'idx_{table_name}_{column_name}_nd',
+        column_name,
+        postgresql_using='gist',
+        postgresql_ops={column_name: 'gist_geometry_ops_nd'},
+    )
+
+
 # SQLAlchemy Models
 class Base(DeclarativeBase, MappedAsDataclass):
     pass
@@ -17,15 +31,23 @@ class DBScan(Base):
     dimensions : Mapped[str]
     voxel_size : Mapped[str]
 
+    # Hash of the scan data, used to skip the scans that are inserted again without changes
+    content_hash : Mapped[str | None] = mapped_column(default=None)
+
     # Relationships
     regions: Mapped[list['DBScanRegion']] = relationship(init=False, back_populates='scan')
 
 
 class DBScanRegion(Base):
     __tablename__ = 'scan_region'
+    __table_args__ = (
+        create_nd_spatial_index('scan_region', 'centroid'),
+        create_nd_spatial_index('scan_region', 'bounding_box'),
+        create_nd_spatial_index('scan_region', 'shape'),
+    )
 
     id      : Mapped[int] = mapped_column(init=False, primary_key=True, autoincrement=True)
-    scan_id : Mapped[int] = mapped_column(ForeignKey('scan.id'))
+    scan_id : Mapped[int] = mapped_column(ForeignKey('scan.id', ondelete='CASCADE'), index=True)
 
     # Region atlas properties
     name  : Mapped[str] = mapped_column(index=True)
@@ -40,8 +62,77 @@ class DBScanRegion(Base):
     median_intensity : Mapped[float]
 
     # Geometric properties
-    centroid : Mapped[Geometry] = mapped_column(Geometry('POINTZ', srid=4326),)
-    shape    : Mapped[Geometry] = mapped_column(Geometry('POLYHEDRALSURFACEZ', srid=4326))
+    centroid     : Mapped[Geometry] = mapped_column(Geometry('POINTZ', srid=4326, spatial_index=False))
+    # Box of the world coordinates of the shape, used to filter the regions before testing their shape, or
+    # NULL if the shape is empty
+    bounding_box : Mapped[Geometry | None] = mapped_column(
+        Geometry('POLYHEDRALSURFACEZ', srid=4326, spatial_index=False),
+    )
+    shape        : Mapped[Geometry] = mapped_column(Geometry('POLYHEDRALSURFACEZ', srid=4326, spatial_index=False))
+
+    # Relationships
+    scan   : Mapped['DBScan'] = relationship(init=False, back_populates='regions')
+    levels : Mapped[list['DBScanRegionLevel']] = relationship(init=False, back_populates='region')
+
+
+class DBScanRegionLevel(Base):
+    __tablename__ = 'scan_region_level'
+
+    id             : Mapped[int] = mapped_column(init=False, primary_key=True, autoincrement=True)
+    scan_region_id : Mapped[int] = mapped_column(ForeignKey('scan_region.id', ondelete='CASCADE'), index=True)
+
+    # Ratio of the faces of the full region shape kept in this level
+    ratio      : Mapped[float]
+    face_count : Mapped[int]
+
+    # Geometric properties
+    shape : Mapped[Geometry] = mapped_column(Geometry('POLYHEDRALSURFACEZ', srid=4326))
 
     # Relationships
-    scan: Mapped['DBScan'] = relationship(init=False, back_populates='regions')
+    region: Mapped['DBScanRegion'] = relationship(init=False, back_populates='levels')
+
+
+class DBRegionAggregate(Base):
+    """
+    Aggregates of the statistics of all the scan regions of an atlas region, maintained when scans are
+    inserted or deleted so that cohort summaries do not need to read the scan regions.
+    """
+
+    __tablename__ = 'region_aggregate'
+
+    # Region atlas properties
+    name  : Mapped[str] = mapped_column(primary_key=True)
+    value : Mapped[int] = mapped_column(primary_key=True)
+
+    # Number of aggregated scan regions
+    count : Mapped[int]
+
+    voxel_count_sum         : Mapped[float]
+    voxel_count_sum_squares : Mapped[float]
+    voxel_count_min         : Mapped[float]
+    voxel_count_max         : Mapped[float]
+
+    mean_intensity_sum         : Mapped[float]
+    mean_intensity_sum_squares : Mapped[float]
+    mean_intensity_min         : Mapped[float]
+    mean_intensity_max         : Mapped[float]
+
+    std_intensity_sum         : Mapped[float]
+    std_intensity_sum_squares : Mapped[float]
+    std_intensity_min         : Mapped[float]
+    std_intensity_max         : Mapped[float]
+
+    min_intensity_sum         : Mapped[float]
+    min_intensity_sum_squares : Mapped[float]
+    min_intensity_min         : Mapped[float]
+    min_intensity_max         : Mapped[float]
+
+    max_intensity_sum         : Mapped[float]
+    max_intensity_sum_squares : Mapped[float]
+    max_intensity_min         : Mapped[float]
+    max_intensity_max         : Mapped[float]
+
+    median_intensity_sum         : Mapped[float]
+    median_intensity_sum_squares : Mapped[float]
+    median_intensity_min         : Mapped[float]
+    median_intensity_max         : Mapped[float]
@@ -1,9 +1,19 @@
+from typing import Any
+
+import numpy as np
+from geoalchemy2 import Geometry
 from geoalchemy2.functions import ST_GeomFromEWKT
-from sqlalchemy import select
+from sqlalchemy import Float, LargeBinary, bindparam, delete, func, insert, select, update
 from sqlalchemy.orm import Session
 
-from brain_region_database.database.models import DBScan, DBScanRegion
-from brain_region_database.scan import Point3D, Scan
+from brain_region_database.database.aggregate import (
+    rebuild_region_aggregates,
+    subtract_region_aggregates,
+    update_region_aggregates,
+)
+from brain_region_database.database.geometry import create_point_ewkb, create_polyhedral_surface_ewkb
+from brain_region_database.database.models import DBScan, DBScanRegion, DBScanRegionLevel
+from brain_region_database.scan import Point3D, Scan, ScanMetadata, ScanRegion, ScanRegionLevel
 
 
 def select_scan(db: Session, file_name: str) -> DBScan | None:
@@ -12,38 +22,306 @@ def select_scan(db: Session, file_name: str) -> DBScan | None:
     ).scalar_one_or_none()
 
 
+def select_scan_hashes(db: Session, file_names: list[str]) -> dict[str, str | None]:
+    """
+    Select the content hashes of the inserted scans among the given file names.
+    """
+
+    return dict(db.execute(
+        select(DBScan.file_name, DBScan.content_hash).where(DBScan.file_name.in_(file_names))
+    ).tuples().all())
+
+
+def delete_scans(db: Session, file_names: list[str]):
+    """
+    Delete scans along with their regions, and remove these regions from the region aggregates. The
+    aggregates are only rebuilt for the regions whose minimum or maximum was deleted. The
+    transaction is not committed.
+    """
+
+    if file_names == []:
+        return
+
+    scan_ids = list(db.scalars(select(DBScan.id).where(DBScan.file_name.in_(file_names))).all())
+
+    rebuilt_names = subtract_region_aggregates(db, scan_ids)
+
+    db.execute(delete(DBScan).where(DBScan.id.in_(scan_ids)))
+
+    if rebuilt_names != []:
+        rebuild_region_aggregates(db, rebuilt_names)
+
+
 def insert_scan(db: Session, scan: Scan) -> DBScan:
-    # Insert the main scan record.
-    db_scan = DBScan(
-        file_name=scan.file_name,
-        file_size=scan.file_size,
-        dimensions=scan.dimensions,
-        voxel_size=scan.voxel_size,
+    scan_id, = insert_scans(db, [scan])
+
+    db.commit()
+    return db.get_one(DBScan, scan_id)
+
+
+def insert_scans(db: Session, scans: list[Scan], content_hashes: list[str] | None = None) -> list[int]:
+    """
+    Insert scans and all their regions with one multi-row statement per table, without going
+    through the ORM unit of work, and add these regions to the region aggregates. The transaction
+    is not committed.
+    """
+
+    if scans == []:
+        return []
+
+    scan_ids = insert_scan_records(db, scans, content_hashes)
+
+    insert_scan_regions(db, [
+        (scan_id, region)
+        for scan_id, scan in zip(scan_ids, scans)
+        for region in scan.regions
+    ])
+
+    update_region_aggregates(db, scan_ids)
+
+    return scan_ids
+
+
+def insert_scan_records(
+    db: Session,
+    scans: list[ScanMetadata],
+    content_hashes: list[str] | None = None,
+) -> list[int]:
+    """
+    Insert the main records of scans without their regions. The transaction is not committed.
+    """
+
+    scan_ids = db.scalars(
+        insert(DBScan).returning(DBScan.id, sort_by_parameter_order=True),
+        [
+            {
+                'file_name':    scan.file_name,
+                'file_size':    scan.file_size,
+                'dimensions':   scan.dimensions,
+                'voxel_size':   scan.voxel_size,
+                'content_hash': content_hash,
+            }
+            for scan, content_hash in zip(scans, content_hashes or [None] * len(scans))
+        ],
+    ).all()
+
+    return list(scan_ids)
+
+
+def update_scan_content_hash(db: Session, scan_id: int, content_hash: str):
+    """
+    Set the content hash of a scan whose content was only known once its regions were inserted.
+    The transaction is not committed.
+    """
+
+    db.execute(update(DBScan).where(DBScan.id == scan_id).values(content_hash=content_hash))
+
+
+def insert_scan_regions(db: Session, regions: list[tuple[int, ScanRegion]]):
+    """
+    Insert the regions of already inserted scans, along with their simplified shapes, with one
+    multi-row statement per table. The region aggregates are not updated and the transaction is not
+    committed.
+    """
+
+    region_rows = [create_region_row(scan_id, region) for scan_id, region in regions]
+
+    if region_rows == []:
+        return
+
+    region_ids = db.scalars(
+        insert(DBScanRegion)
+            .values(
+                centroid=func.ST_GeomFromEWKB(bindparam('centroid_ewkb', type_=LargeBinary)),
+                bounding_box=func.ST_GeomFromEWKT(bindparam('bounding_box_ewkt')),
+                shape=func.ST_GeomFromEWKB(bindparam('shape_ewkb', type_=LargeBinary)),
+            )
+            .returning(DBScanRegion.id, sort_by_parameter_order=True),
+        region_rows,
+    ).all()
+
+    # Insert the simplified shapes of the regions.
+    level_rows = [
+        create_region_level_row(region_id, level)
+        for region_id, (_, region) in zip(region_ids, regions)
+        for level in region.levels
+    ]
+
+    if level_rows != []:
+        db.execute(
+            insert(DBScanRegionLevel).values(
+                shape=func.ST_GeomFromEWKB(bindparam('shape_ewkb', type_=LargeBinary)),
+            ),
+            level_rows,
+        )
+
+
+def create_region_row(scan_id: int, region: ScanRegion) -> dict[str, Any]:
+    vertices, faces = region.shape
+    bounding_box = get_vertices_box(vertices)
+
+    return {
+        'scan_id':          scan_id,
+        'name':             region.name,
+        'value':            region.value,
+        'voxel_count':      region.voxel_count,
+        'mean_intensity':   region.mean_intensity,
+        'std_intensity':    region.std_intensity,
+        'min_intensity':    region.min_intensity,
+        'max_intensity':    region.max_intensity,
+        'median_intensity': region.median_intensity,
+        'centroid_ewkb':     create_point_ewkb(region.centroid),
+        'bounding_box_ewkt': f"SRID=4326;{create_box(bounding_box)}" if bounding_box is not None else None,
+        'shape_ewkb':        create_polyhedral_surface_ewkb(vertices, faces),
+    }
+
+
+def get_vertices_box(vertices: np.ndarray) -> tuple[Point3D, Point3D] | None:
+    """
+    Get the box of the vertices of a shape, or `None` if the shape is empty, so that an empty shape
+    is not matched by the spatial queries.
+    """
+
+    if len(vertices) == 0:
+        return None
+
+    return Point3D.from_array(vertices.min(axis=0)), Point3D.from_array(vertices.max(axis=0))
+
+
+def create_region_level_row(region_id: int, level: ScanRegionLevel) -> dict[str, Any]:
+    return {
+        'scan_region_id': region_id,
+        'ratio':          level.ratio,
+        'face_count':     len(level.shape[1]),
+        'shape_ewkb':     create_polyhedral_surface_ewkb(*level.shape),
+    }
+
+
+def select_region_shape(db: Session, region: DBScanRegion, precision: float) -> Geometry:
+    """
+    Select the lightest shape of a region that keeps at least the given ratio of the faces of its
+    full shape, which is the full shape itself if no simplified shape is precise enough.
+    """
+
+    level_shape = db.scalars(
+        select(DBScanRegionLevel.shape)
+            .where(DBScanRegionLevel.scan_region_id == region.id, DBScanRegionLevel.ratio >= precision)
+            .order_by(DBScanRegionLevel.ratio)
+            .limit(1)
+    ).one_or_none()
+
+    return level_shape if level_shape is not None else region.shape
+
+
+def select_scan_region_shapes(db: Session, scan: DBScan, precision: float) -> list[tuple[DBScanRegion, Geometry]]:
+    """
+    Select the regions of a scan, each with its lightest shape that keeps at least the given ratio
+    of the faces of its full shape.
+    """
+
+    region_ids = select(DBScanRegion.id).where(DBScanRegion.scan_id == scan.id).scalar_subquery()
+
+    # Simplified shapes ordered from the lightest to the most precise, per region.
+    level_shapes: dict[int, Geometry] = {}
+    for region_id, shape in db.execute(
+        select(DBScanRegionLevel.scan_region_id, DBScanRegionLevel.shape)
+            .where(DBScanRegionLevel.scan_region_id.in_(region_ids), DBScanRegionLevel.ratio >= precision)
+            .order_by(DBScanRegionLevel.scan_region_id, DBScanRegionLevel.ratio)
+    ).tuples():
+        level_shapes.setdefault(region_id, shape)
+
+    return [(region, level_shapes.get(region.id, region.shape)) for region in scan.regions]
+
+
+def select_regions_intersecting_box(
+    db: Session,
+    bounding_box: tuple[Point3D, Point3D],
+    scan_id: int | None = None,
+) -> list[DBScanRegion]:
+    """
+    Select the regions whose solid intersects a 3D box in world coordinates, which includes the
+    regions inside the box and those containing it. The regions are first filtered on their indexed
+    bounding box, and only then on the solids enclosed by their shape and by the box, which
+    requires the `postgis_sfcgal` extension.
+    """
+
+    box = ST_GeomFromEWKT(f"SRID=4326;{create_box(bounding_box)}")
+
+    query = select(DBScanRegion).where(
+        DBScanRegion.bounding_box.op('&&&')(box),
+        func.ST_3DIntersects(func.ST_MakeSolid(DBScanRegion.shape), func.ST_MakeSolid(box)),
     )
 
-    db.add(db_scan)
-    db.flush()
-
-    # Insert the scan region records.
-    for region in scan.regions:
-        db.add(DBScanRegion(
-            scan_id=db_scan.id,
-            name=region.name,
-            value=region.value,
-            voxel_count=region.voxel_count,
-            mean_intensity=region.mean_intensity,
-            std_intensity=region.std_intensity,
-            min_intensity=region.min_intensity,
-            max_intensity=region.max_intensity,
-            median_intensity=region.median_intensity,
-            centroid=ST_GeomFromEWKT(create_point(region.centroid), srid=4326),
-            # bounding_box=WKTElement(create_box(region.bounding_box))
-            shape=ST_GeomFromEWKT(create_postgis_3d_geometry(region.shape[0], region.shape[1]), srid=4326),
-        ))
+    if scan_id is not None:
+        query = query.where(DBScanRegion.scan_id == scan_id)
 
-    db.commit()
-    db.refresh(db_scan)
-    return db_scan
+    return list(db.scalars(query).all())
+
+
+def select_regions_nearest_point(
+    db: Session,
+    point: Point3D,
+    limit: int = 10,
+    scan_id: int | None = None,
+    candidate_factor: int = 4,
+) -> list[tuple[DBScanRegion, float]]:
+    """
+    Select the regions whose shape is nearest to a point in world coordinates, along with their
+    distance. The regions nearest to the point by their bounding box are found with the index, and
+    only these candidates are ordered by the exact distance of their shape. As the distance to the
+    bounding box of a region is a lower bound of the distance to its shape, the candidates are
+    extended until no other region can be nearer, so that the result is exact.
+    """
+
+    point_geometry = ST_GeomFromEWKT(f"SRID=4326;{create_point(point)}")
+
+    box_distance = DBScanRegion.bounding_box.op('<<#>>', return_type=Float)(point_geometry)
+    distance     = func.ST_3DDistance(DBScanRegion.shape, point_geometry)
+
+    candidate_count = limit * candidate_factor
+    while True:
+        candidates = select(DBScanRegion.id, box_distance.label('box_distance')).where(
+            DBScanRegion.bounding_box.is_not(None),
+        )
+
+        if scan_id is not None:
+            candidates = candidates.where(DBScanRegion.scan_id == scan_id)
+
+        candidates = candidates.order_by(box_distance).limit(candidate_count).subquery()
+
+        rows = db.execute(
+            select(DBScanRegion, distance, candidates.c.box_distance)
+                .join(candidates, DBScanRegion.id == candidates.c.id)
+                .order_by(distance)
+        ).tuples().all()
+
+        nearest = [(region, region_distance) for region, region_distance, _ in rows[:limit]]
+
+        # The regions that are not candidates are at least as far as the farthest candidate box.
+        if len(rows) < candidate_count or nearest == [] or nearest[-1][1] <= max(row[2] for row in rows):
+            return nearest
+
+        candidate_count *= 2
+
+
+def select_regions_containing_point(db: Session, point: Point3D, scan_id: int | None = None) -> list[DBScanRegion]:
+    """
+    Select the regions whose shape contains a point in world coordinates. The regions are first
+    filtered on their indexed bounding box, and only then on the solid enclosed by their shape,
+    which requires the `postgis_sfcgal` extension.
+    """
+
+    point_geometry = ST_GeomFromEWKT(f"SRID=4326;{create_point(point)}")
+
+    query = select(DBScanRegion).where(
+        DBScanRegion.bounding_box.op('&&&')(point_geometry),
+        func.ST_3DIntersects(func.ST_MakeSolid(DBScanRegion.shape), point_geometry),
+    )
+
+    if scan_id is not None:
+        query = query.where(DBScanRegion.scan_id == scan_id)
+
+    return list(db.scalars(query).all())
 
 
 def create_point(centroid: Point3D) -> str:
@@ -52,15 +330,23 @@ def create_point(centroid: Point3D) -> str:
 
 def create_box(bounding_box: tuple[Point3D, Point3D]) -> str:
     min, max = bounding_box
-    # ruff: noqa
-    return f"""POLYHEDRALSURFACE Z (
-        (({min.x} {min.y} {min.z}, {max.x} {min.y} {min.z}, {max.x} {max.y} {min.z}, {min.x} {max.y} {min.z}, {min.x} {min.y} {min.z})),
-        (({min.x} {min.y} {max.z}, {max.x} {min.y} {max.z}, {max.x} {max.y} {max.z}, {min.x} {max.y} {max.z}, {min.x} {min.y} {max.z})),
-        (({min.x} {min.y} {min.z}, {max.x} {min.y} {min.z}, {max.x} {min.y} {max.z}, {min.x} {min.y} {max.z}, {min.x} {min.y} {min.z})),
-        (({min.x} {max.y} {min.z}, {max.x} {max.y} {min.z}, {max.x} {max.y} {max.z}, {min.x} {max.y} {max.z}, {min.x} {max.y} {min.z})),
-        (({min.x} {min.y} {min.z}, {min.x} {max.y} {min.z}, {min.x} {max.y} {max.z}, {min.x} {min.y} {max.z}, {min.x} {min.y} {min.z})),
-        (({max.x} {min.y} {min.z}, {max.x} {max.y} {min.z}, {max.x} {max.y} {max.z}, {max.x} {min.y} {max.z}, {max.x} {min.y} {min.z}))
-    )"""
+
+    # Faces of the box, each as a ring of corners closed by repeating its first corner.
+    faces = [
+        [(min.x, min.y, min.z), (max.x, min.y, min.z), (max.x, max.y, min.z), (min.x, max.y, min.z)],
+        [(min.x, min.y, max.z), (max.x, min.y, max.z), (max.x, max.y, max.z), (min.x, max.y, max.z)],
+        [(min.x, min.y, min.z), (max.x, min.y, min.z), (max.x, min.y, max.z), (min.x, min.y, max.z)],
+        [(min.x, max.y, min.z), (max.x, max.y, min.z), (max.x, max.y, max.z), (min.x, max.y, max.z)],
+        [(min.x, min.y, min.z), (min.x, max.y, min.z), (min.x, max.y, max.z), (min.x, min.y, max.z)],
+        [(max.x, min.y, min.z), (max.x, max.y, min.z), (max.x, max.y, max.z), (max.x, min.y, max.z)],
+    ]
+
+    polygons = ", ".join(
+        "((" + ", ".join(f"{x} {y} {z}" for x, y, z in [*face, face[0]]) + "))"
+        for face in faces
+    )
+
+    return f"POLYHEDRALSURFACE Z ({polygons})"
 
 
 def create_postgis_3d_geometry(
@@ -0,0 +1,133 @@
+import json
+from collections.abc import Iterator
+from typing import Any, TextIO
+
+# Number of characters read from the file at once.
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# Characters that can follow a complete JSON number.
+NUMBER_DELIMITERS = frozenset(',]} \t\r\n')
+
+
+class JsonStream:
+    """
+    Incremental reader of a JSON document, which walks its objects and arrays one member at a time
+    and only keeps the value being decoded and a chunk of the file in memory.
+    """
+
+    def __init__(self, file: TextIO, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.file       = file
+        self.chunk_size = chunk_size
+        self.decoder    = json.JSONDecoder()
+        self.buffer     = ''
+        self.position   = 0
+        self.eof        = False
+
+    def fill(self, size: int):
+        """
+        Read more characters from the file, dropping the characters already consumed.
+        """
+
+        chunk = self.file.read(size)
+        if chunk == '':
+            self.eof = True
+
+        self.buffer   = self.buffer[self.position:] + chunk
+        self.position = 0
+
+    def peek(self) -> str:
+        """
+        Skip the whitespace and return the next character, or an empty string at the end of the
+        file.
+        """
+
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\r\n':
+                self.position += 1
+
+            if self.position < len(self.buffer) or self.eof:
+                return self.buffer[self.position:self.position + 1]
+
+            self.fill(self.chunk_size)
+
+    def expect(self, character: str):
+        found = self.peek()
+        if found != character:
+            raise ValueError(f"Expected '{character}' in JSON document, found '{found}'.")
+
+        self.position += 1
+
+    def read_value(self) -> Any:
+        """
+        Decode the next JSON value. The buffer is extended until it contains the whole value, and
+        until a delimiter follows a number so that a number cut at the end of the buffer, such as
+        `1.` or `2.5e`, is not decoded as its valid prefix.
+        """
+
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                if self.eof or (end < len(self.buffer) and (
+                    not isinstance(value, int | float) or self.buffer[end] in NUMBER_DELIMITERS
+                )):
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+
+            # Grow the reads geometrically so that a large value is not decoded too many times.
+            self.fill(size)
+            size *= 2
+
+    def iter_object(self) -> Iterator[str]:
+        """
+        Iterate over the keys of the next JSON object. The value of each key must be read or
+        iterated over before requesting the next key.
+        """
+
+        self.expect('{')
+        if self.peek() == '}':
+            self.position += 1
+            return
+
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise ValueError(f"Expected a key in JSON object, found '{key}'.")
+
+            self.expect(':')
+            yield key
+
+            match self.peek():
+                case ',':
+                    self.position += 1
+                case '}':
+                    self.position += 1
+                    return
+                case found:
+                    raise ValueError(f"Expected ',' or '}}' in JSON object, found '{found}'.")
+
+    def iter_array(self) -> Iterator[Any]:
+        """
+        Iterate over the values of the next JSON array, decoding them one at a time.
+        """
+
+        self.expect('[')
+        if self.peek() == ']':
+            self.position += 1
+            return
+
+        while True:
+            yield self.read_value()
+
+            match self.peek():
+                case ',':
+                    self.position += 1
+                case ']':
+                    self.position += 1
+                    return
+                case found:
+                    raise ValueError(f"Expected ',' or ']' in JSON array, found '{found}'.")
@@ -0,0 +1,83 @@
+import base64
+from typing import Any
+
+import numpy as np
+
+# Maximum distance, in lattice steps, between a vertex and the lattice for the vertex to be on it,
+# which absorbs the rounding of the marching cubes and of the affine transform.
+LATTICE_TOLERANCE = 1e-3
+
+# Integer types in which the lattice coordinates and face deltas are stored, narrowest first.
+VERTEX_TYPES = (np.uint8, np.uint16, np.uint32)
+FACE_TYPES   = (np.int8, np.int16, np.int32, np.int64)
+
+
+def encode_lattice_mesh(vertices: np.ndarray, faces: np.ndarray, lattice: np.ndarray) -> dict[str, Any] | None:
+    """
+    Encode a mesh whose vertices are on a lattice, given the affine from the lattice coordinates to
+    world coordinates. The vertices are stored as the offsets of their lattice coordinates from the
+    minimum ones, and the faces as the differences between consecutive vertex indices, both in the
+    narrowest integer type that fits them and encoded in base64. Return `None` if a vertex is not
+    on the lattice.
+    """
+
+    if len(vertices) == 0:
+        return None
+
+    coordinates = apply_affine(np.linalg.inv(lattice), vertices)
+    lattice_coordinates = np.rint(coordinates)
+    if np.max(np.abs(coordinates - lattice_coordinates)) > LATTICE_TOLERANCE:
+        return None
+
+    lattice_coordinates = lattice_coordinates.astype(np.int64)
+    origin  = lattice_coordinates.min(axis=0)
+    offsets = lattice_coordinates - origin
+
+    face_deltas = np.diff(faces.ravel(), prepend=0)
+
+    vertex_type = get_narrowest_type(offsets, VERTEX_TYPES)
+    face_type   = get_narrowest_type(face_deltas, FACE_TYPES)
+
+    return {
+        'origin':      origin.tolist(),
+        'vertices':    encode_array(offsets, vertex_type),
+        'vertex_type': np.dtype(vertex_type).name,
+        'faces':       encode_array(face_deltas, face_type),
+        'face_type':   np.dtype(face_type).name,
+    }
+
+
+def decode_lattice_mesh(encoded: dict[str, Any], lattice: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decode a mesh encoded with `encode_lattice_mesh` into world coordinates vertices and faces.
+    """
+
+    offsets = decode_array(encoded['vertices'], encoded['vertex_type']).reshape(-1, 3)
+    vertices = apply_affine(lattice, offsets + np.array(encoded['origin'], dtype=np.int64))
+
+    face_deltas = decode_array(encoded['faces'], encoded['face_type'])
+    faces = np.cumsum(face_deltas, dtype=np.int64).reshape(-1, 3)
+
+    return vertices, faces
+
+
+def apply_affine(affine: np.ndarray, coordinates: np.ndarray) -> np.ndarray:
+    return coordinates @ affine[:3, :3].T + affine[:3, 3]
+
+
+def get_narrowest_type(array: np.ndarray, types: tuple[type[np.integer], ...]) -> type[np.integer]:
+    minimum, maximum = (array.min().item(), array.max().item()) if array.size > 0 else (0, 0)
+    for integer_type in types:
+        info = np.iinfo(integer_type)
+        if info.min <= minimum and maximum <= info.max:
+            return integer_type
+
+    return types[-1]
+
+
+def encode_array(array: np.ndarray, integer_type: type[np.integer]) -> str:
+    return base64.b64encode(array.astype(np.dtype(integer_type).newbyteorder('<')).tobytes()).decode()
+
+
+def decode_array(text: str, type_name: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(text), dtype=np.dtype(type_name).newbyteorder('<')).astype(np.int64)
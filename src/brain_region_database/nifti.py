@@ -1,4 +1,3 @@
-import tempfile
 from pathlib import Path
 from typing import Any, Literal
 
@@ -29,6 +28,16 @@ def load_nifti_image(path: Path) -> NiftiImage:
     return image  # type: ignore
 
 
+def get_nifti_data(image: NiftiImage) -> np.ndarray:
+    """
+    Get the voxel data of a NIfTI image in its on-disk data type, unlike `get_fdata` which always
+    returns a cached float64 copy. The data of an uncompressed file is memory-mapped, and is only
+    converted to floating point if the header defines a scaling.
+    """
+
+    return np.asanyarray(image.dataobj)  # type: ignore
+
+
 def has_same_dims(image: NiftiImage, template: NiftiImage) -> bool:
     return np.allclose(image.affine, template.affine) and image.shape == template.shape  # type: ignore
 
@@ -62,13 +71,40 @@ def get_voxel_size(image: NiftiImage) -> str:
         return "1.00x1.00x1.00mm"
 
 
+# Flip between the RAS+ world coordinates of NIfTI and the LPS+ world coordinates of ITK and ANTs.
+RAS_TO_LPS = np.diag([-1.0, -1.0, 1.0])
+
+
 def ants_to_nib(image: ANTsImage) -> NiftiImage:
-    _, temp_path = tempfile.mkstemp(suffix='.nii')
-    ants.image_write(image, temp_path)  # type: ignore
-    return load_nifti_image(Path(temp_path))
+    """
+    Convert an ANTs image to a NIfTI image in memory, without copying the voxel data twice.
+    """
+
+    spacing   = np.array(image.spacing[:3])  # type: ignore
+    direction = np.array(image.direction)[:3, :3]  # type: ignore
+    origin    = np.array(image.origin[:3])  # type: ignore
+
+    affine = np.eye(4)
+    affine[:3, :3] = RAS_TO_LPS @ direction @ np.diag(spacing)
+    affine[:3, 3]  = RAS_TO_LPS @ origin
+
+    nifti_image = Nifti1Image(image.numpy(), affine)  # type: ignore
+    nifti_image.set_qform(affine, code=1)
+    nifti_image.set_sform(affine, code=1)
+    return nifti_image
 
 
 def nib_to_ants(image: NiftiImage) -> ANTsImage:
-    _, temp_path = tempfile.mkstemp(suffix='.nii')
-    nib.save(image, temp_path)  # type: ignore
-    return ants.image_read(temp_path)  # type: ignore
+    """
+    Convert a NIfTI image to a single precision ANTs image in memory.
+    """
+
+    affine  = image.affine  # type: ignore
+    spacing = np.linalg.norm(affine[:3, :3], axis=0)  # type: ignore
+
+    return ants.from_numpy(  # type: ignore
+        np.asarray(get_nifti_data(image), dtype=np.float32),
+        origin=(RAS_TO_LPS @ affine[:3, 3]).tolist(),  # type: ignore
+        spacing=spacing.tolist(),
+        direction=RAS_TO_LPS @ affine[:3, :3] @ np.diag(1 / spacing),  # type: ignore
+    )
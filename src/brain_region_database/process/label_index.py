@@ -0,0 +1,173 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from brain_region_database.nifti import NiftiImage, get_nifti_data
+from brain_region_database.process.registration import evict_cache_entries
+from brain_region_database.process.statistics import LabelGroups, compute_group_bounding_boxes, group_labels
+
+DEFAULT_LABEL_INDEX_CACHE_SIZE = 2 * 1024 ** 3
+
+# Arrays of a label index entry, each stored in its own NPY file so that it can be memory-mapped.
+LABEL_INDEX_ARRAYS = ('values', 'offsets', 'indices', 'bounding_boxes')
+
+
+@dataclass
+class LabelIndexCache:
+    """
+    On-disk cache of the label groups of an atlas, each entry being a directory named after the
+    hash of the atlas labels and of the voxel grid in which they are grouped.
+    """
+
+    path: Path
+    max_size: int = DEFAULT_LABEL_INDEX_CACHE_SIZE
+
+
+def get_atlas_label_index_cache(atlas_path: Path) -> LabelIndexCache:
+    """
+    Get the label index cache stored next to an atlas image.
+    """
+
+    return LabelIndexCache(atlas_path.parent / f"{atlas_path.name}.index")
+
+
+def get_registered_label_index_cache(atlas_path: Path) -> LabelIndexCache:
+    """
+    Get the label index cache of the atlas registered on scans, which is stored next to the atlas
+    image separately from the index of the atlas itself so that they do not evict each other.
+    """
+
+    return LabelIndexCache(atlas_path.parent / f"{atlas_path.name}.registered-index")
+
+
+def index_labels(
+    labels_image: NiftiImage,
+    values: Iterable[int],
+    cache: LabelIndexCache | None = None,
+    key: str | None = None,
+) -> LabelGroups:
+    """
+    Group the voxels of a label image by label value, or reuse the groups from the cache if the
+    same labels were already grouped. The cache key is the hash of the label image, unless a key
+    that identifies it is given.
+    """
+
+    values = list(values)
+    labels = get_nifti_data(labels_image)
+
+    if cache is None:
+        return group_labels(labels, values)
+
+    if key is None:
+        key = hash_label_index(labels_image, labels.shape[:3], labels_image.affine, values)  # type: ignore
+
+    groups = load_label_index(cache, key, labels.shape)
+    if groups is not None:
+        print("Using cached atlas label index.")
+        return groups
+
+    return store_label_index(cache, key, group_labels(labels, values))
+
+
+def hash_label_index(
+    labels_image: NiftiImage,
+    shape: tuple[int, ...],
+    affine: np.ndarray,
+    values: list[int],
+) -> str:
+    """
+    Hash the content and geometry of a label image, the voxel grid in which its labels are grouped,
+    and the grouped label values.
+    """
+
+    labels = np.ascontiguousarray(get_nifti_data(labels_image))
+
+    digest = hashlib.sha256(repr((
+        str(labels.dtype),
+        labels.shape,
+        np.asarray(labels_image.affine).tolist(),  # type: ignore
+        tuple(shape),
+        np.asarray(affine).tolist(),
+        sorted(values),
+    )).encode())
+    digest.update(memoryview(labels).cast('B'))
+
+    return digest.hexdigest()
+
+
+def hash_registered_label_index(
+    registration_key: str,
+    transforms_key: str,
+    interpolation: str,
+    values: list[int],
+) -> str:
+    """
+    Hash the label index of an atlas registered on a scan, which is identified by the cache key of
+    its registration, the hash of the transforms applied to it and its interpolation without hashing
+    the registered atlas.
+    """
+
+    return hashlib.sha256(repr((
+        'registered',
+        registration_key,
+        transforms_key,
+        interpolation,
+        sorted(values),
+    )).encode()).hexdigest()
+
+
+def load_label_index(cache: LabelIndexCache, key: str, shape: tuple[int, ...]) -> LabelGroups | None:
+    """
+    Load a label index entry from the cache, with its arrays memory-mapped.
+    """
+
+    entry_path = cache.path / key
+    if not entry_path.is_dir():
+        return None
+
+    # Mark the entry as recently used for the eviction.
+    os.utime(entry_path)
+
+    arrays = {name: np.load(entry_path / f"{name}.npy", mmap_mode='r') for name in LABEL_INDEX_ARRAYS}
+
+    return LabelGroups(
+        shape=shape,
+        values=np.asarray(arrays['values']),
+        offsets=np.asarray(arrays['offsets']),
+        indices=arrays['indices'],
+        bounding_boxes=np.asarray(arrays['bounding_boxes']),
+    )
+
+
+def store_label_index(cache: LabelIndexCache, key: str, groups: LabelGroups) -> LabelGroups:
+    """
+    Store the label groups and the bounding boxes of their labels in the cache, and return the
+    groups with their bounding boxes.
+    """
+
+    groups.bounding_boxes = compute_group_bounding_boxes(groups)
+
+    cache.path.mkdir(parents=True, exist_ok=True)
+
+    # Write the entry in a temporary directory first so that concurrent processes never see a
+    # partial entry.
+    temp_path = Path(tempfile.mkdtemp(dir=cache.path, prefix='.tmp-'))
+    for name in LABEL_INDEX_ARRAYS:
+        np.save(temp_path / f"{name}.npy", getattr(groups, name))
+
+    entry_path = cache.path / key
+    try:
+        temp_path.rename(entry_path)
+    except OSError:
+        # Another process stored the same entry in the meantime.
+        shutil.rmtree(temp_path)
+
+    evict_cache_entries(cache.path, cache.max_size, entry_path)
+
+    return groups
@@ -1,11 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from nibabel.nifti1 import Nifti1Image
 from scipy.ndimage import map_coordinates  # type: ignore
 
 from brain_region_database.nifti import Interpolation, NiftiImage
 
+# Number of reference voxels resampled at once, which bounds the size of the coordinate arrays.
+CHUNK_VOXELS = 1 << 21
+
+
+def reorient_nifti(
+    image: NiftiImage,
+    reference: NiftiImage,
+    interpolation: Interpolation,
+    jobs: int = 1,
+) -> NiftiImage:
+    """
+    Resample an image in the voxel grid of a reference image. The reference grid is resampled by
+    slabs along its first axis, so that the memory used is the size of the input and output images
+    plus the coordinates of a single slab.
+    """
 
-def reorient_nifti(image: NiftiImage, reference: NiftiImage, interpolation: Interpolation) -> NiftiImage:
     match interpolation:
         case 'nearest':
             order = 0
@@ -15,28 +31,49 @@ def reorient_nifti(image: NiftiImage, reference: NiftiImage, interpolation: Inte
     # Get the affine matrices and data
     image_affine     = image.affine  # type: ignore
     reference_affine = reference.affine  # type: ignore
-    image_data = image.get_fdata()
+    image_data = image.get_fdata(caching='unchanged')
 
     # Get reference image shape
-    reference_shape = reference.shape
+    reference_shape = reference.shape[:3]
+
+    # Convert world coordinates to moving image coordinates
+    inverse_image_affine = np.linalg.inv(image_affine)  # type: ignore
 
-    # Create coordinate grid in reference space
-    i, j, k = np.mgrid[:reference_shape[0], :reference_shape[1], :reference_shape[2]]
+    reoriented_data = np.empty(reference_shape, dtype=np.float64)
 
-    # Convert reference coordinates to world coordinates
-    world_coords = np.dot(reference_affine, np.vstack([i.ravel(), j.ravel(), k.ravel(), np.ones(i.size)]))  # type: ignore
+    slab_size = max(1, CHUNK_VOXELS // (reference_shape[1] * reference_shape[2]))
 
-    # Convert world coordinates to moving image coordinates
-    moving_coords = np.dot(np.linalg.inv(image_affine), world_coords)  # type: ignore
+    def resample_slab(start: int):
+        stop = min(start + slab_size, reference_shape[0])
+
+        # Create coordinate grid of the slab in reference space
+        i, j, k = np.mgrid[start:stop, :reference_shape[1], :reference_shape[2]]
+
+        # Convert reference coordinates to world coordinates, then to moving image coordinates, in the
+        # same way as for the whole grid so that the results do not depend on the slab size.
+        reference_coords = np.vstack([i.ravel(), j.ravel(), k.ravel(), np.ones(i.size)])
+        world_coords     = np.dot(reference_affine, reference_coords)  # type: ignore
+        moving_coords    = np.dot(inverse_image_affine, world_coords)  # type: ignore
 
-    # Extract the physical coordinates (remove homogeneous coordinate)
-    moving_coords_physical = moving_coords[:3]
+        coords_array = moving_coords[:3].reshape(3, stop - start, *reference_shape[1:])
 
-    # Reshape for interpolation
-    coords_array = moving_coords_physical.reshape(3, *reference_shape)
+        # Apply interpolation
+        map_coordinates(  # type: ignore
+            image_data,
+            coords_array,
+            output=reoriented_data[start:stop],
+            order=order,
+            mode='constant',
+            cval=0.0,
+        )
 
-    # Apply interpolation
-    reoriented_data = map_coordinates(image_data, coords_array, order=order, mode='constant', cval=0.0)  # type: ignore
+    starts = range(0, reference_shape[0], slab_size)
+    if jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(resample_slab, starts))
+    else:
+        for start in starts:
+            resample_slab(start)
 
     # Create a new NIfTI image with the reoriented data and reference affine
     reoriented_img = Nifti1Image(reoriented_data, reference_affine, header=reference.header)  # type: ignore
@@ -0,0 +1,45 @@
+from collections.abc import Generator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+
+@dataclass
+class SharedArray:
+    """
+    Handle of a NumPy array stored in shared memory, which is cheap to send to other processes.
+    """
+
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+@contextmanager
+def share_array(array: np.ndarray) -> Generator[SharedArray, None, None]:
+    """
+    Copy an array in a shared memory block that lives as long as the context.
+    """
+
+    memory = SharedMemory(create=True, size=max(array.nbytes, 1))
+    try:
+        shared = np.ndarray(array.shape, array.dtype, buffer=memory.buf)
+        shared[...] = array
+        # Release the view so that the shared memory block can be closed.
+        del shared
+        yield SharedArray(memory.name, array.shape, array.dtype.str)
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def attach_shared_array(handle: SharedArray) -> tuple[SharedMemory, np.ndarray]:
+    """
+    Attach to an array shared by a parent process. The returned shared memory block must be kept
+    alive as long as the array is used.
+    """
+
+    memory = SharedMemory(name=handle.name)
+    return memory, np.ndarray(handle.shape, np.dtype(handle.dtype), buffer=memory.buf)
@@ -1,21 +1,202 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
 import ants  # type: ignore
 from ants import ANTsImage  # type: ignore
 
 from brain_region_database.nifti import Interpolation  # type: ignore
 
+REGISTRATION_TRANSFORM = 'SyN'
+
+DEFAULT_REGISTRATION_CACHE_SIZE = 10 * 1024 ** 3
+
+
+@dataclass
+class RegistrationCache:
+    """
+    On-disk cache of registration forward transforms, each entry being a directory named after the
+    hash of the registered images and parameters.
+    """
+
+    path: Path
+    max_size: int = DEFAULT_REGISTRATION_CACHE_SIZE
+
+
+def register_nifti(
+    image: ANTsImage,
+    reference: ANTsImage,
+    interpolation: Interpolation,
+    cache: RegistrationCache | None = None,
+) -> ANTsImage:
+    """
+    Register an image on a reference image.
+    """
+
+    transforms = compute_registration_transforms(image, reference, cache)
+    return apply_registration_transforms(image, reference, transforms, interpolation)
+
+
+def apply_registration_transforms(
+    image: ANTsImage,
+    reference: ANTsImage,
+    transforms: list[str],
+    interpolation: Interpolation,
+) -> ANTsImage:
+    """
+    Resample an image on a reference image with the transforms computed by
+    `compute_registration_transforms`.
+    """
 
-def register_nifti(image: ANTsImage, reference: ANTsImage, interpolation: Interpolation) -> ANTsImage:
     match interpolation:
         case 'continuous':
             interpolator = 'linear'
         case 'nearest':
             interpolator = 'nearestNeighbor'
 
-    registration = ants.registration(fixed=reference, moving=image, type_of_transform='SyN')  # type: ignore
-
     return ants.apply_transforms(  # type: ignore
         fixed=reference,
         moving=image,
-        transformlist=registration['fwdtransforms'],  # type: ignore
+        transformlist=transforms,
         interpolator=interpolator,
     )
+
+
+def compute_registration_transforms(
+    image: ANTsImage,
+    reference: ANTsImage,
+    cache: RegistrationCache | None = None,
+    key: str | None = None,
+) -> list[str]:
+    """
+    Compute the forward transforms that register an image on a reference image, or reuse them from
+    the cache if these images were already registered.
+    """
+
+    if cache is None:
+        return run_registration(image, reference)
+
+    if key is None:
+        key = hash_registration(image, reference)
+
+    transforms = load_cached_transforms(cache, key)
+    if transforms is not None:
+        print("Using cached registration transforms.")
+        return transforms
+
+    return store_cached_transforms(cache, key, run_registration(image, reference))
+
+
+def run_registration(image: ANTsImage, reference: ANTsImage) -> list[str]:
+    registration = ants.registration(  # type: ignore
+        fixed=reference,
+        moving=image,
+        type_of_transform=REGISTRATION_TRANSFORM,
+    )
+
+    return registration['fwdtransforms']  # type: ignore
+
+
+def hash_registration(image: ANTsImage, reference: ANTsImage) -> str:
+    """
+    Hash the content and geometry of the registered images and the registration parameters.
+    """
+
+    digest = hashlib.sha256(REGISTRATION_TRANSFORM.encode())
+    for ants_image in (reference, image):
+        digest.update(repr((
+            ants_image.pixeltype,
+            ants_image.shape,
+            ants_image.spacing,
+            ants_image.origin,
+            ants_image.direction.tolist(),
+        )).encode())
+        digest.update(ants_image.numpy().tobytes())
+
+    return digest.hexdigest()
+
+
+def hash_transforms(transforms: list[str]) -> str:
+    """
+    Hash the content of transform files. The registration is not deterministic, so the transforms
+    computed again for the same images after their eviction from the cache can differ.
+    """
+
+    digest = hashlib.sha256()
+    for transform in transforms:
+        with open(transform, 'rb') as file:
+            digest.update(hashlib.file_digest(file, 'sha256').digest())
+
+    return digest.hexdigest()
+
+
+def load_cached_transforms(cache: RegistrationCache, key: str) -> list[str] | None:
+    entry_path = cache.path / key
+    if not entry_path.is_dir():
+        return None
+
+    # Mark the entry as recently used for the eviction.
+    os.utime(entry_path)
+
+    return [str(path) for path in sorted(entry_path.iterdir())]
+
+
+def store_cached_transforms(cache: RegistrationCache, key: str, transforms: list[str]) -> list[str]:
+    cache.path.mkdir(parents=True, exist_ok=True)
+
+    # Write the entry in a temporary directory first so that concurrent processes never see a
+    # partial entry.
+    temp_path = Path(tempfile.mkdtemp(dir=cache.path, prefix='.tmp-'))
+    for i, transform in enumerate(transforms):
+        shutil.copyfile(transform, temp_path / f"{i}_{get_transform_suffix(transform)}")
+
+    entry_path = cache.path / key
+    try:
+        temp_path.rename(entry_path)
+    except OSError:
+        # Another process stored the same entry in the meantime.
+        shutil.rmtree(temp_path)
+
+    evict_cached_transforms(cache, entry_path)
+
+    return [str(path) for path in sorted(entry_path.iterdir())]
+
+
+def evict_cached_transforms(cache: RegistrationCache, keep_path: Path):
+    evict_cache_entries(cache.path, cache.max_size, keep_path)
+
+
+def evict_cache_entries(cache_path: Path, max_size: int, keep_path: Path):
+    """
+    Remove the least recently used entry directories of a cache until it fits in its maximum size,
+    except for the entry that is being used.
+    """
+
+    entries = [
+        (entry_path.stat().st_mtime, get_directory_size(entry_path), entry_path)
+        for entry_path in cache_path.iterdir()
+        if entry_path.is_dir() and not entry_path.name.startswith('.')
+    ]
+
+    size = sum(entry_size for _, entry_size, _ in entries)
+    for _, entry_size, entry_path in sorted(entries):
+        if size <= max_size:
+            break
+
+        if entry_path == keep_path:
+            continue
+
+        shutil.rmtree(entry_path, ignore_errors=True)
+        size -= entry_size
+
+
+def get_directory_size(path: Path) -> int:
+    return sum(file_path.stat().st_size for file_path in path.iterdir())
+
+
+def get_transform_suffix(transform: str) -> str:
+    name = Path(transform).name
+    return 'transform.nii.gz' if name.endswith('.nii.gz') else f"transform{Path(name).suffix}"
@@ -0,0 +1,144 @@
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class LabelGroups:
+    """
+    Voxels of a label volume grouped by label value, the voxels of the label `values[i]` being
+    `indices[offsets[i]:offsets[i + 1]]` in C order. The bounding boxes of the labels, of shape
+    (N, 2, 3), are only present if they were precomputed.
+    """
+
+    shape: tuple[int, ...]
+    values: np.ndarray
+    offsets: np.ndarray
+    indices: np.ndarray
+    bounding_boxes: np.ndarray | None = None
+
+
+@dataclass
+class LabelStatistics:
+    value: int
+    voxel_count: int
+    mean_intensity: float
+    std_intensity: float
+    min_intensity: float
+    max_intensity: float
+    median_intensity: float
+    centroid: np.ndarray
+    bounding_box: tuple[np.ndarray, np.ndarray]
+
+
+def group_labels(labels: np.ndarray, values: Iterable[int]) -> LabelGroups:
+    """
+    Group the voxels of a label volume by label value using a single stable sort. Only the voxels
+    whose label is in `values` are kept, labels without any voxel are absent from the groups.
+    """
+
+    flat_labels = labels.ravel()
+
+    # Keep only the voxels of the requested labels, in C order.
+    candidates = np.flatnonzero(np.isin(flat_labels, np.fromiter(values, dtype=np.int64)))
+
+    # A stable sort keeps the voxels of each label in C order, like `np.argwhere` does.
+    order   = np.argsort(flat_labels[candidates], kind='stable')
+    indices = candidates[order]
+
+    if len(indices) == 0:
+        return LabelGroups(labels.shape, np.empty(0, np.int64), np.zeros(1, np.int64), indices)
+
+    sorted_labels = flat_labels[indices]
+    starts = np.flatnonzero(np.diff(sorted_labels)) + 1
+    offsets = np.concatenate(([0], starts, [len(indices)])).astype(np.int64)
+
+    return LabelGroups(
+        shape=labels.shape,
+        values=sorted_labels[offsets[:-1]].astype(np.int64),
+        offsets=offsets,
+        indices=indices,
+    )
+
+
+def compute_label_statistics(
+    labels: np.ndarray,
+    data: np.ndarray,
+    values: Iterable[int],
+) -> dict[int, LabelStatistics]:
+    """
+    Compute the statistics of all the labels of a label volume at once, with one pass to group the
+    voxels by label instead of one pass per label.
+    """
+
+    return compute_group_statistics(group_labels(labels, values), data)
+
+
+def compute_group_statistics(groups: LabelGroups, data: np.ndarray) -> dict[int, LabelStatistics]:
+    if len(groups.values) == 0:
+        return {}
+
+    starts = groups.offsets[:-1]
+    counts = np.diff(groups.offsets)
+
+    # Gather the intensities and coordinates of all the labelled voxels.
+    intensities = data.ravel()[groups.indices]
+    coordinates = np.stack(np.unravel_index(groups.indices, groups.shape), axis=1)
+
+    # Coordinates are integers, so these reductions give the same results as per-label reductions.
+    centroids = np.add.reduceat(coordinates, starts, axis=0) / counts[:, np.newaxis]
+    if groups.bounding_boxes is not None:
+        min_coordinates = groups.bounding_boxes[:, 0]
+        max_coordinates = groups.bounding_boxes[:, 1]
+    else:
+        min_coordinates = np.minimum.reduceat(coordinates, starts, axis=0)
+        max_coordinates = np.maximum.reduceat(coordinates, starts, axis=0)
+    min_intensities = np.minimum.reduceat(intensities, starts)
+    max_intensities = np.maximum.reduceat(intensities, starts)
+
+    statistics: dict[int, LabelStatistics] = {}
+    for i, value in enumerate(groups.values.tolist()):
+        # Each label is a contiguous slice, which keeps the floating point reductions of the intensities
+        # identical to the ones done on a masked volume.
+        region_intensities = intensities[groups.offsets[i]:groups.offsets[i + 1]]
+
+        statistics[value] = LabelStatistics(
+            value=value,
+            voxel_count=counts[i].item(),
+            mean_intensity=np.mean(region_intensities).item(),
+            std_intensity=np.std(region_intensities).item(),
+            min_intensity=min_intensities[i].item(),
+            max_intensity=max_intensities[i].item(),
+            median_intensity=np.median(region_intensities).item(),
+            centroid=centroids[i],
+            bounding_box=(min_coordinates[i], max_coordinates[i]),
+        )
+
+    return statistics
+
+
+def get_group_coordinates(groups: LabelGroups, i: int) -> np.ndarray:
+    """
+    Get the voxel coordinates of the label `groups.values[i]`, as an array of shape (N, 3).
+    """
+
+    indices = groups.indices[groups.offsets[i]:groups.offsets[i + 1]]
+    return np.stack(np.unravel_index(indices, groups.shape), axis=1)
+
+
+def compute_group_bounding_boxes(groups: LabelGroups) -> np.ndarray:
+    """
+    Compute the voxel bounding boxes of the labels of a label volume, as an array of shape (N, 2, 3)
+    of the minimum and maximum coordinates of each label.
+    """
+
+    if len(groups.values) == 0:
+        return np.empty((0, 2, 3), np.int64)
+
+    starts = groups.offsets[:-1]
+    coordinates = np.stack(np.unravel_index(groups.indices, groups.shape), axis=1)
+    return np.stack((
+        np.minimum.reduceat(coordinates, starts, axis=0),
+        np.maximum.reduceat(coordinates, starts, axis=0),
+    ), axis=1)
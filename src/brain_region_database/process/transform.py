@@ -0,0 +1,144 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from nibabel.nifti1 import Nifti1Image
+from scipy.ndimage import gaussian_filter, map_coordinates, spline_filter  # type: ignore
+
+from brain_region_database.nifti import Interpolation, NiftiImage
+from brain_region_database.process.orientation import CHUNK_VOXELS
+
+
+@dataclass
+class VoxelGrid:
+    """
+    The voxel grid of an image, that is, its shape and its voxel to world affine.
+    """
+
+    shape: tuple[int, int, int]
+    affine: np.ndarray
+
+
+@dataclass
+class GridTransform:
+    """
+    A resampling step, described by its output grid and by the affine mapping from the voxels of
+    its output grid to the voxels of its input grid.
+    """
+
+    grid: VoxelGrid
+    mapping: np.ndarray
+    anti_aliasing: bool = False
+
+
+def get_image_grid(image: NiftiImage) -> VoxelGrid:
+    return VoxelGrid(image.shape[:3], image.affine)  # type: ignore
+
+
+def create_reference_transform(grid: VoxelGrid, reference: NiftiImage) -> GridTransform:
+    """
+    Create the transform that resamples a grid in the voxel grid of a reference image, which is
+    what both respatialization and reorientation do.
+    """
+
+    reference_grid = get_image_grid(reference)
+    mapping = np.linalg.inv(grid.affine) @ reference_grid.affine
+    return GridTransform(reference_grid, mapping)
+
+
+def create_resize_transform(grid: VoxelGrid, reference: NiftiImage) -> GridTransform:
+    """
+    Create the transform that resizes a grid to the shape of a reference image, with the same
+    voxel center mapping and output affine as `resize_nifti`.
+    """
+
+    reference_shape = reference.shape[:3]
+    scale_factors = np.array(grid.shape) / np.array(reference_shape)
+
+    mapping = np.eye(4)
+    mapping[:3, :3] = np.diag(scale_factors)
+    mapping[:3, 3]  = 0.5 * scale_factors - 0.5
+
+    affine = grid.affine.copy()
+    affine[:3, :3] = affine[:3, :3] @ np.diag(scale_factors)
+
+    return GridTransform(VoxelGrid(reference_shape, affine), mapping, anti_aliasing=True)
+
+
+def resample_nifti(
+    image: NiftiImage,
+    transforms: list[GridTransform],
+    order: int,
+    dtype: np.dtype | None = None,
+    jobs: int = 1,
+) -> NiftiImage:
+    """
+    Apply a chain of resampling steps to an image in a single interpolation pass. The voxel
+    mappings of the steps are composed so that each output voxel is interpolated directly from the
+    input image, and the output is written by slabs in the requested data type.
+    """
+
+    mapping = np.eye(4)
+    for transform in transforms:
+        mapping = mapping @ transform.mapping
+
+    grid = transforms[-1].grid
+    data = image.get_fdata(caching='unchanged')
+
+    # Smooth the input before downsampling like `resize_nifti` does, using the total scale of the
+    # composed mapping along each input axis.
+    if order > 0 and any(transform.anti_aliasing for transform in transforms):
+        scale_factors = np.linalg.norm(mapping[:3, :3], axis=1)
+        sigmas = np.maximum(0, (scale_factors - 1) / 2)
+        if np.any(sigmas > 0):
+            data = gaussian_filter(data, sigmas, mode='constant', cval=0.0)
+
+    # Compute the spline coefficients once rather than once per slab.
+    if order > 1:
+        data = spline_filter(data, order=order)
+
+    output = np.empty(grid.shape, dtype=dtype or np.float64)
+
+    slab_size = max(1, CHUNK_VOXELS // (grid.shape[1] * grid.shape[2]))
+
+    def resample_slab(start: int):
+        stop = min(start + slab_size, grid.shape[0])
+
+        i, j, k = np.mgrid[start:stop, :grid.shape[1], :grid.shape[2]]
+        output_coords = np.vstack([i.ravel(), j.ravel(), k.ravel(), np.ones(i.size)])
+        input_coords  = mapping @ output_coords
+
+        map_coordinates(  # type: ignore
+            data,
+            input_coords[:3].reshape(3, stop - start, *grid.shape[1:]),
+            output=output[start:stop],
+            order=order,
+            mode='constant',
+            cval=0.0,
+            prefilter=False,
+        )
+
+    starts = range(0, grid.shape[0], slab_size)
+    if jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(resample_slab, starts))
+    else:
+        for start in starts:
+            resample_slab(start)
+
+    resampled_image = Nifti1Image(output, grid.affine, header=image.header)  # type: ignore
+    resampled_image.header.set_data_dtype(output.dtype)
+    return resampled_image
+
+
+def get_interpolation_order(interpolation: Interpolation, spline: bool = False) -> int:
+    """
+    Get the spline order of an interpolation. Continuous interpolation is linear, or cubic to
+    match nilearn when the chain contains a respatialization.
+    """
+
+    match interpolation:
+        case 'nearest':
+            return 0
+        case 'continuous':
+            return 3 if spline else 1
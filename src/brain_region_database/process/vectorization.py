@@ -1,20 +1,40 @@
+from collections.abc import Sequence
+
 import numpy as np
 import trimesh
 from skimage import measure
 
 from brain_region_database.nifti import NiftiImage, Zooms
 
+# Default ratios of faces of the simplified meshes of a region.
+DEFAULT_MESH_LEVELS = (0.25, 0.05)
+
+MIN_LEVEL_FACES = 16
+
 
 def compute_nifti_mask_mesh(
     original: NiftiImage,
-    data: np.ndarray,
+    labels: np.ndarray,
+    value: int,
+    bounding_box: tuple[np.ndarray, np.ndarray],
     simplify: bool = False,
     decimate_factor: float = 0.5,
 ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the surface mesh of a label of a label volume. Only the bounding box of the label, padded
+    by one voxel, is meshed, which makes the cost proportional to the size of the region rather than
+    the size of the volume.
+    """
+
     header = original.header
     zooms  = header.get_zooms()
 
-    verts, faces = extract_surface_marching_cubes(data, zooms, original.affine)
+    mask, offset = crop_label_mask(labels, value, bounding_box)
+
+    # Fold the offset of the crop in the affine, marching cubes scales the vertices by the zooms.
+    affine = original.affine @ create_translation(offset * np.array(zooms[:3]))  # type: ignore
+
+    verts, faces = extract_surface_marching_cubes(mask, zooms, affine)
 
     if simplify and len(faces) > 10000:
         verts, faces = simplify_mesh(verts, faces, decimate_factor)
@@ -22,6 +42,46 @@ def compute_nifti_mask_mesh(
     return verts, faces
 
 
+def compute_mesh_lattice(original: NiftiImage) -> np.ndarray:
+    """
+    Compute the affine from the lattice coordinates of the vertices of the meshes computed with
+    `compute_nifti_mask_mesh` to world coordinates. The marching cubes of a binary mask at the level
+    0.5 places every vertex in the middle of an edge between two voxels, so the vertices are on a
+    lattice of half voxels whose integer coordinates are twice the voxel coordinates.
+    """
+
+    zooms = np.array(original.header.get_zooms()[:3], dtype=np.float64)
+
+    # Same transform as the one applied to the marching cubes vertices, which are scaled by the zooms.
+    return original.affine @ np.diag([*(zooms / 2), 1.0])  # type: ignore
+
+
+def crop_label_mask(
+    labels: np.ndarray,
+    value: int,
+    bounding_box: tuple[np.ndarray, np.ndarray],
+    padding: int = 1,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Crop the mask of a label to its bounding box padded by a few voxels, and return it with the
+    voxel offset of the crop in the volume.
+    """
+
+    min_voxel, max_voxel = bounding_box
+    start = np.maximum(np.asarray(min_voxel, dtype=np.int64) - padding, 0)
+    stop  = np.minimum(np.asarray(max_voxel, dtype=np.int64) + padding + 1, labels.shape[:3])
+
+    crop = labels[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]]
+
+    return (crop == value).astype(np.float32), start
+
+
+def create_translation(offset: np.ndarray) -> np.ndarray:
+    translation = np.eye(4)
+    translation[:3, 3] = offset
+    return translation
+
+
 def extract_surface_marching_cubes(
     mask: np.ndarray,
     zooms: Zooms,
@@ -33,7 +93,7 @@ def extract_surface_marching_cubes(
     """
 
     verts, faces, normals, values = measure.marching_cubes(
-        mask.astype(float),
+        mask if mask.dtype in (np.float32, np.float64) else mask.astype(np.float32),
         level=level,
         spacing=zooms,
         allow_degenerate=False
@@ -69,6 +129,28 @@ def simplify_mesh(
 
     target_faces = int(len(faces) * factor)
 
-    simplified = mesh.simplify_quadric_decimation(target_faces)
+    simplified = mesh.simplify_quadric_decimation(face_count=target_faces)
 
     return simplified.vertices, simplified.faces
+
+
+def compute_mesh_levels(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    ratios: Sequence[float],
+) -> list[tuple[float, np.ndarray, np.ndarray]]:
+    """
+    Compute simplified versions of a mesh, each with a given ratio of the faces of the full mesh.
+    Each level is simplified from the full mesh, and the levels that would have less than a few
+    faces are skipped.
+    """
+
+    levels: list[tuple[float, np.ndarray, np.ndarray]] = []
+    for ratio in ratios:
+        if int(len(faces) * ratio) < MIN_LEVEL_FACES:
+            continue
+
+        level_vertices, level_faces = simplify_mesh(vertices, faces, ratio)
+        levels.append((ratio, level_vertices, level_faces))
+
+    return levels
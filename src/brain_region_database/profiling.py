@@ -0,0 +1,178 @@
+import atexit
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from collections.abc import Generator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+
+@dataclass
+class TraceSpan:
+    """
+    A traced stage of a command. The peak memory is the maximum memory allocated by Python and
+    NumPy during the stage in addition to the memory in use at its start, and the maximum resident
+    set size is that of the whole process at the end of the stage, which includes native libraries.
+    """
+
+    name: str
+    depth: int
+    pid: int
+    start_time: float
+    wall_time: float
+    cpu_time: float
+    peak_memory: int
+    max_rss: int
+    attributes: dict[str, Any]
+
+
+@dataclass
+class Trace:
+    start_time: float
+    start_wall_time: float
+    start_cpu_time: float
+    spans: list[TraceSpan] = field(default_factory=list)
+    # Peak memory reached by the children of each open span, as each span resets the peak.
+    peak_stack: list[int] = field(default_factory=list)
+
+
+# Trace of the current process, if profiling is enabled.
+active_trace: Trace | None = None
+
+
+def start_trace(output_path: Path | None = None):
+    """
+    Start tracing the stages of the current process. If an output path is given, the trace is
+    written to it when the process exits. Worker processes start a trace without an output path
+    and send their spans back to the main process.
+    """
+
+    global active_trace
+    tracemalloc.start()
+    active_trace = Trace(time.time(), time.perf_counter(), time.process_time())
+    if output_path is not None:
+        atexit.register(write_trace, output_path)
+
+
+def is_tracing() -> bool:
+    return active_trace is not None
+
+
+@contextmanager
+def trace_span(name: str, **attributes: Any) -> Generator[None, None, None]:
+    """
+    Trace the wall time, CPU time and memory of a stage, if profiling is enabled. Spans can be
+    nested, but should only be opened from the main thread of a process.
+    """
+
+    trace = active_trace
+    if trace is None:
+        yield
+        return
+
+    start_memory, peak_memory = tracemalloc.get_traced_memory()
+    if trace.peak_stack != []:
+        trace.peak_stack[-1] = max(trace.peak_stack[-1], peak_memory)
+
+    tracemalloc.reset_peak()
+    trace.peak_stack.append(0)
+
+    start_time      = time.time()
+    start_wall_time = time.perf_counter()
+    start_cpu_time  = time.process_time()
+
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - start_wall_time
+        cpu_time  = time.process_time() - start_cpu_time
+
+        _, peak_memory = tracemalloc.get_traced_memory()
+        peak_memory = max(peak_memory, trace.peak_stack.pop())
+        if trace.peak_stack != []:
+            trace.peak_stack[-1] = max(trace.peak_stack[-1], peak_memory)
+
+        trace.spans.append(TraceSpan(
+            name=name,
+            depth=len(trace.peak_stack),
+            pid=os.getpid(),
+            start_time=start_time,
+            wall_time=wall_time,
+            cpu_time=cpu_time,
+            peak_memory=max(peak_memory - start_memory, 0),
+            max_rss=get_max_rss(),
+            attributes=attributes,
+        ))
+
+
+def collect_trace_spans() -> list[TraceSpan]:
+    """
+    Remove and return the spans traced so far, which is used to send the spans of a worker process
+    to the main process.
+    """
+
+    if active_trace is None:
+        return []
+
+    spans = active_trace.spans
+    active_trace.spans = []
+    return spans
+
+
+def add_trace_spans(spans: list[TraceSpan]):
+    """
+    Add the spans traced by a worker process to the trace of the current process, nested in the
+    currently open span.
+    """
+
+    if active_trace is None:
+        return
+
+    depth = len(active_trace.peak_stack)
+    for span in spans:
+        span.depth += depth
+
+    active_trace.spans.extend(spans)
+
+
+def write_trace(output_path: Path):
+    """
+    Write the trace of the current process as JSON, with the totals of the command and its spans in
+    the order in which they started.
+    """
+
+    if active_trace is None:
+        return
+
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    trace = {
+        'command': Path(sys.argv[0]).name,
+        'arguments': sys.argv[1:],
+        'pid': os.getpid(),
+        'start_time': active_trace.start_time,
+        'wall_time': time.perf_counter() - active_trace.start_wall_time,
+        'cpu_time': time.process_time() - active_trace.start_cpu_time,
+        'children_cpu_time': children_usage.ru_utime + children_usage.ru_stime,
+        'max_rss': get_max_rss(),
+        'spans': [asdict(span) for span in sorted(active_trace.spans, key=lambda span: span.start_time)],
+    }
+
+    with open(output_path, 'w') as file:
+        json.dump(trace, file, indent=2)
+
+    print(f"Profiling trace written to '{output_path}'.", file=sys.stderr)
+
+
+def get_max_rss() -> int:
+    """
+    Get the maximum resident set size of the current process in bytes.
+    """
+
+    # Linux reports the maximum resident set size in kilobytes.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
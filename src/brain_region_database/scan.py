@@ -1,5 +1,15 @@
+import hashlib
+import json
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Annotated, Any, TextIO
+
 import numpy as np
-from pydantic import BaseModel
+from pydantic import BaseModel, PlainSerializer, PlainValidator, field_serializer, model_validator
+from pydantic_core import to_json
+
+from brain_region_database.json_stream import JsonStream
+from brain_region_database.lattice import decode_lattice_mesh, encode_lattice_mesh
 
 
 class Point3D(BaseModel):
@@ -16,7 +26,106 @@ class Point3D(BaseModel):
         )
 
 
-class ScanRegion(BaseModel):
+def validate_mesh_array(value: Any, dtype: type[np.generic]) -> np.ndarray:
+    """
+    Validate the vertices or faces of a mesh as an array of shape (N, 3) with a given data type. An
+    array that already has this data type is not copied, and faces must contain integers.
+    """
+
+    array = np.asarray(value)
+    if array.size == 0:
+        return np.empty((0, 3), dtype)
+
+    if array.ndim != 2 or array.shape[1] != 3:
+        raise ValueError(f"mesh array must have the shape (N, 3), not {array.shape}")
+
+    if np.issubdtype(dtype, np.integer):
+        is_valid = np.issubdtype(array.dtype, np.integer)
+    else:
+        is_valid = np.issubdtype(array.dtype, np.integer) or np.issubdtype(array.dtype, np.floating)
+
+    if not is_valid:
+        raise ValueError(f"mesh array of type {array.dtype} cannot be converted to {np.dtype(dtype)}")
+
+    return array.astype(dtype, copy=False)
+
+
+def serialize_mesh_array(array: np.ndarray) -> list[list[Any]]:
+    return array.tolist()
+
+
+# The meshes are stored as NumPy arrays, which are only converted to lists when serialized as JSON.
+type MeshVertices = Annotated[
+    np.ndarray,
+    PlainValidator(lambda value: validate_mesh_array(value, np.float64)),
+    PlainSerializer(serialize_mesh_array, return_type=list[list[float]], when_used='json'),
+]
+
+type MeshFaces = Annotated[
+    np.ndarray,
+    PlainValidator(lambda value: validate_mesh_array(value, np.int64)),
+    PlainSerializer(serialize_mesh_array, return_type=list[list[int]], when_used='json'),
+]
+
+type Mesh = tuple[MeshVertices, MeshFaces]
+
+
+def is_equal_value(value: Any, other: Any) -> bool:
+    """
+    Compare two field values that may contain NumPy arrays, which are equal if they have the same
+    shape and elements.
+    """
+
+    if isinstance(value, np.ndarray) or isinstance(other, np.ndarray):
+        return isinstance(value, np.ndarray) and isinstance(other, np.ndarray) and np.array_equal(value, other)
+
+    if isinstance(value, list | tuple) and isinstance(other, list | tuple):
+        return type(value) is type(other) and len(value) == len(other) and all(map(is_equal_value, value, other))
+
+    if isinstance(value, dict) and isinstance(other, dict):
+        return value.keys() == other.keys() and all(is_equal_value(value[key], other[key]) for key in value)
+
+    return value == other
+
+
+class ArrayModel(BaseModel):
+    """
+    Model with NumPy array fields, which the default equality cannot compare.
+    """
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, BaseModel):
+            return NotImplemented
+
+        return type(self) is type(other) and is_equal_value(self.__dict__, other.__dict__)
+
+
+def validate_lattice(value: Any) -> np.ndarray:
+    array = np.asarray(value, dtype=np.float64)
+    if array.shape != (4, 4):
+        raise ValueError(f"mesh lattice must be a 4x4 affine, not an array of shape {array.shape}")
+
+    return array
+
+
+# Affine from the coordinates of the half-voxel lattice of the marching cubes to world coordinates.
+type MeshLattice = Annotated[
+    np.ndarray,
+    PlainValidator(validate_lattice),
+    PlainSerializer(serialize_mesh_array, return_type=list[list[float]], when_used='json'),
+]
+
+
+class ScanRegionLevel(ArrayModel):
+    """
+    Simplified mesh of a region, with a given ratio of the faces of the full mesh.
+    """
+
+    ratio: float
+    shape: Mesh
+
+
+class ScanRegion(ArrayModel):
     name: str
     value: int
     voxel_count: int
@@ -27,12 +136,260 @@ class ScanRegion(BaseModel):
     median_intensity: float
     centroid: Point3D
     bounding_box: tuple[Point3D, Point3D]
-    shape: tuple[list[tuple[float, float, float]], list[tuple[int, int, int]]]
+    shape: Mesh
+    levels: list[ScanRegionLevel] = []
+
 
+def encode_region_json(region: ScanRegion, lattice: np.ndarray) -> dict[str, Any]:
+    """
+    Convert a region to JSON data with its full mesh encoded on the lattice of the scan, if its
+    vertices are on it.
+    """
 
-class Scan(BaseModel):
+    data = region.model_dump(mode='json', exclude={'shape'})
+    encoded = encode_lattice_mesh(*region.shape, lattice)
+    if encoded is None:
+        encoded = [serialize_mesh_array(region.shape[0]), serialize_mesh_array(region.shape[1])]
+
+    # Keep the order of the fields.
+    return {name: data[name] if name != 'shape' else encoded for name in ScanRegion.model_fields}
+
+
+def decode_region_json(data: Any, lattice: np.ndarray | None) -> Any:
+    """
+    Decode the full mesh of a region in JSON data if it is encoded on the lattice of the scan.
+    """
+
+    if lattice is None or not isinstance(data, dict) or not isinstance(data.get('shape'), dict):
+        return data
+
+    return {**data, 'shape': decode_lattice_mesh(data['shape'], lattice)}
+
+
+class ScanMetadata(ArrayModel):
     file_name: str
     file_size: int
     dimensions: str
     voxel_size: str
+    # If the lattice of the full meshes of the regions is known, these meshes are written in JSON as
+    # integer lattice coordinates, see `encode_lattice_mesh`. The simplified meshes are not on it.
+    lattice: MeshLattice | None = None
+
+
+class Scan(ScanMetadata):
     regions: list[ScanRegion]
+
+    @model_validator(mode='before')
+    @classmethod
+    def decode_regions(cls, data: Any) -> Any:
+        if not isinstance(data, dict) or data.get('lattice') is None or not isinstance(data.get('regions'), list):
+            return data
+
+        lattice = validate_lattice(data['lattice'])
+        return {**data, 'regions': [decode_region_json(region, lattice) for region in data['regions']]}
+
+    @field_serializer('regions', mode='wrap', when_used='json')
+    def encode_regions(self, regions: list[ScanRegion], handler: Any) -> Any:
+        if self.lattice is None:
+            return handler(regions)
+
+        lattice = self.lattice
+        return [encode_region_json(region, lattice) for region in regions]
+
+
+def hash_scan(scan: Scan) -> str:
+    """
+    Hash the canonical JSON of a scan, which does not depend on the format of the file the scan was
+    read from, nor on its formatting.
+    """
+
+    return hashlib.sha256(scan.model_dump_json().encode()).hexdigest()
+
+
+def hash_scan_stream(metadata: ScanMetadata, regions: Iterable[ScanRegion]) -> str:
+    """
+    Hash a scan read incrementally, with the same hash as `hash_scan` but without keeping all its
+    regions in memory.
+    """
+
+    digest = hashlib.sha256()
+
+    # The canonical JSON of a scan is its metadata object extended with its array of regions.
+    digest.update(metadata.model_dump_json().removesuffix('}').encode())
+    digest.update(b',"regions":[')
+    for i, region in enumerate(regions):
+        if i > 0:
+            digest.update(b',')
+
+        if metadata.lattice is not None:
+            digest.update(to_json(encode_region_json(region, metadata.lattice)))
+        else:
+            digest.update(region.model_dump_json().encode())
+
+    digest.update(b']}')
+
+    return digest.hexdigest()
+
+
+def write_scan(scan: Scan, path: Path):
+    """
+    Write a scan in a file, as binary NPZ if the file has the `.npz` extension, or as JSON otherwise.
+    """
+
+    if path.suffix == '.npz':
+        write_scan_npz(scan, path)
+    else:
+        with open(path, 'w') as file:
+            file.write(scan.model_dump_json(indent=4))
+
+
+def read_scan(path: Path) -> Scan:
+    """
+    Read a scan from a file, as binary NPZ if the file has the `.npz` extension, or as JSON otherwise.
+    """
+
+    if path.suffix == '.npz':
+        return read_scan_npz(path)
+
+    with open(path) as file:
+        return Scan.model_validate_json(file.read())
+
+
+def read_scan_json_stream(file: TextIO) -> tuple[ScanMetadata, Iterator[ScanRegion]]:
+    """
+    Read a JSON scan incrementally, returning its metadata and an iterator that decodes and
+    validates its regions one at a time, so that only one region is kept in memory. If the regions
+    come before some of the required metadata in the document, they are read all at once instead.
+    The lattice of the regions must come before them, as in the documents written by `write_scan`.
+    """
+
+    stream = JsonStream(file)
+    keys = stream.iter_object()
+
+    fields: dict[str, Any] = {}
+    for key in keys:
+        if key == 'regions':
+            break
+
+        fields[key] = stream.read_value()
+    else:
+        return ScanMetadata.model_validate(fields), iter([])
+
+    required_fields = {name for name, field in ScanMetadata.model_fields.items() if field.is_required()}
+    if fields.keys() >= required_fields:
+        metadata = ScanMetadata.model_validate(fields)
+        region_data: Iterable[Any] = stream.iter_array()
+    else:
+        region_data = list(stream.iter_array())
+        for key in keys:
+            fields[key] = stream.read_value()
+
+        metadata = ScanMetadata.model_validate(fields)
+
+    lattice = metadata.lattice
+    return metadata, (ScanRegion.model_validate(decode_region_json(region, lattice)) for region in region_data)
+
+
+def write_scan_npz(scan: Scan, path: Path):
+    """
+    Write a scan as an uncompressed NPZ archive. The scalar statistics of the regions are stored as
+    columns, and the meshes of all the regions as concatenated vertex and face arrays delimited by
+    offsets, the faces indexing the vertices of their own mesh. The simplified meshes are stored in
+    the same way, along with the index of their region.
+    """
+
+    regions = scan.regions
+
+    levels = [(i, level) for i, region in enumerate(regions) for level in region.levels]
+
+    np.savez(
+        path,
+        metadata=np.array(json.dumps({
+            'file_name':  scan.file_name,
+            'file_size':  scan.file_size,
+            'dimensions': scan.dimensions,
+            'voxel_size': scan.voxel_size,
+            'lattice':    scan.lattice.tolist() if scan.lattice is not None else None,
+        })),
+        name=np.array([region.name for region in regions], dtype=str),
+        value=np.array([region.value for region in regions], dtype=np.int64),
+        voxel_count=np.array([region.voxel_count for region in regions], dtype=np.int64),
+        mean_intensity=np.array([region.mean_intensity for region in regions], dtype=np.float64),
+        std_intensity=np.array([region.std_intensity for region in regions], dtype=np.float64),
+        min_intensity=np.array([region.min_intensity for region in regions], dtype=np.float64),
+        max_intensity=np.array([region.max_intensity for region in regions], dtype=np.float64),
+        median_intensity=np.array([region.median_intensity for region in regions], dtype=np.float64),
+        centroid=np.array([point_to_list(region.centroid) for region in regions], dtype=np.float64).reshape(-1, 3),
+        bounding_box=np.array(
+            [[point_to_list(point) for point in region.bounding_box] for region in regions],
+            dtype=np.float64,
+        ).reshape(-1, 2, 3),
+        **pack_meshes('', [region.shape for region in regions]),
+        level_region=np.array([i for i, _ in levels], dtype=np.int64),
+        level_ratio=np.array([level.ratio for _, level in levels], dtype=np.float64),
+        **pack_meshes('level_', [level.shape for _, level in levels]),
+    )
+
+
+def pack_meshes(prefix: str, meshes: list[Mesh]) -> dict[str, np.ndarray]:
+    """
+    Pack meshes as concatenated vertex and face arrays delimited by offsets.
+    """
+
+    vertices = [mesh[0] for mesh in meshes]
+    faces    = [mesh[1] for mesh in meshes]
+
+    return {
+        f'{prefix}vertices':       np.concatenate(vertices) if meshes != [] else np.empty((0, 3), np.float64),
+        f'{prefix}vertex_offsets': np.cumsum([0] + [len(mesh_vertices) for mesh_vertices in vertices], dtype=np.int64),
+        f'{prefix}faces':          np.concatenate(faces) if meshes != [] else np.empty((0, 3), np.int64),
+        f'{prefix}face_offsets':   np.cumsum([0] + [len(mesh_faces) for mesh_faces in faces], dtype=np.int64),
+    }
+
+
+def unpack_mesh(prefix: str, columns: dict[str, np.ndarray], i: int) -> Mesh:
+    vertex_offsets = columns[f'{prefix}vertex_offsets']
+    face_offsets   = columns[f'{prefix}face_offsets']
+    vertices = columns[f'{prefix}vertices'][vertex_offsets[i]:vertex_offsets[i + 1]]
+    faces    = columns[f'{prefix}faces'][face_offsets[i]:face_offsets[i + 1]]
+    return vertices, faces
+
+
+def read_scan_npz(path: Path) -> Scan:
+    with np.load(path) as archive:
+        metadata: dict[str, Any] = json.loads(archive['metadata'].item())
+        columns = {key: archive[key] for key in archive.files if key != 'metadata'}
+
+    # Archives written before the levels were introduced do not contain them.
+    region_levels: dict[int, list[ScanRegionLevel]] = {}
+    for j, i in enumerate(columns.get('level_region', np.empty(0, np.int64)).tolist()):
+        region_levels.setdefault(i, []).append(ScanRegionLevel(
+            ratio=columns['level_ratio'][j].item(),
+            shape=unpack_mesh('level_', columns, j),
+        ))
+
+    regions: list[ScanRegion] = []
+    for i in range(len(columns['value'])):
+        regions.append(ScanRegion(
+            name=columns['name'][i].item(),
+            value=columns['value'][i].item(),
+            voxel_count=columns['voxel_count'][i].item(),
+            mean_intensity=columns['mean_intensity'][i].item(),
+            std_intensity=columns['std_intensity'][i].item(),
+            min_intensity=columns['min_intensity'][i].item(),
+            max_intensity=columns['max_intensity'][i].item(),
+            median_intensity=columns['median_intensity'][i].item(),
+            centroid=Point3D.from_array(columns['centroid'][i]),
+            bounding_box=(
+                Point3D.from_array(columns['bounding_box'][i][0]),
+                Point3D.from_array(columns['bounding_box'][i][1]),
+            ),
+            shape=unpack_mesh('', columns, i),
+            levels=region_levels.get(i, []),
+        ))
+
+    return Scan(**metadata, regions=regions)
+
+
+def point_to_list(point: Point3D) -> list[float]:
+    return [point.x, point.y, point.z]
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+import argparse
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from queue import Full, Queue
+
+from sqlalchemy.orm import Session
+
+from brain_region_database.atlas import load_atlas_dictionary, print_atlas_regions
+from brain_region_database.database.aggregate import update_region_aggregates
+from brain_region_database.database.engine import get_engine
+from brain_region_database.database.query import (
+    delete_scans,
+    insert_scan_records,
+    insert_scan_regions,
+    update_scan_content_hash,
+)
+from brain_region_database.nifti import load_nifti_image
+from brain_region_database.process.label_index import get_registered_label_index_cache
+from brain_region_database.process.registration import DEFAULT_REGISTRATION_CACHE_SIZE, RegistrationCache
+from brain_region_database.process.vectorization import DEFAULT_MESH_LEVELS
+from brain_region_database.profiling import start_trace, trace_span
+from brain_region_database.scan import ScanMetadata, ScanRegion, hash_scan
+from brain_region_database.scripts.analyze_scan_regions import (
+    AnalysisOptions,
+    analyze_scan,
+    create_region_executor,
+    create_scan_metadata,
+    find_scan_paths,
+)
+from brain_region_database.util import print_error_exit, print_warning
+
+
+@dataclass
+class ScanStart:
+    """
+    Message sent to the database writer before the regions of a scan.
+    """
+
+    metadata: ScanMetadata
+
+
+@dataclass
+class ScanEnd:
+    """
+    Message sent to the database writer after the regions of a scan, with the hash of the content
+    of the scan, or `None` if its analysis failed.
+    """
+
+    file_name: str
+    content_hash: str | None
+
+
+# Messages sent to the database writer, `None` being sent once all the scans are analyzed.
+type WriterMessage = ScanStart | ScanRegion | ScanEnd | None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog='analyze_insert_scans',
+        description="Analyze the regions of NIfTI scans and insert them in the database while they are analyzed,"
+            " without going through an intermediate file.",
+    )
+
+    parser.add_argument('--atlas-dictionary',
+        required=True,
+        help="The brain atlas CSV dictionary.")
+
+    parser.add_argument('--atlas-image',
+        required=True,
+        help="The brain atlas NIfTI image.")
+
+    scan_group = parser.add_mutually_exclusive_group(required=True)
+
+    scan_group.add_argument('--scan',
+        help="The brain scan NIfTI image.")
+
+    scan_group.add_argument('--batch',
+        help="A directory of brain scan NIfTI images, a glob pattern, or a text manifest with one scan path per"
+            " line.")
+
+    parser.add_argument('--output',
+        type=Path,
+        help="A JSON lines file in which to also write the analyzed scans.")
+
+    parser.add_argument('--jobs',
+        type=int,
+        default=1,
+        help="The number of processes used to process the regions of each scan in parallel.")
+
+    parser.add_argument('--registration-cache',
+        type=Path,
+        help="A directory in which to cache the registration transforms.")
+
+    parser.add_argument('--registration-cache-size',
+        type=float,
+        default=DEFAULT_REGISTRATION_CACHE_SIZE / 1024 ** 3,
+        help="The maximum size of the registration cache in gigabytes.")
+
+    parser.add_argument('--atlas-index',
+        action='store_true',
+        help="Cache the voxels of each region of the registered atlas in a directory next to the atlas image, which"
+            " is reused when a scan whose registration is cached is analyzed again. Requires --registration-cache.")
+
+    parser.add_argument('--mesh-levels',
+        type=float,
+        nargs='*',
+        default=list(DEFAULT_MESH_LEVELS),
+        help="The ratios of faces of the simplified meshes computed for each region.")
+
+    parser.add_argument('--lattice-meshes',
+        action='store_true',
+        help="Write the vertices of the full meshes in the output file as compact integer coordinates on the voxel"
+            " lattice of the registered atlas.")
+
+    parser.add_argument('--queue-size',
+        type=int,
+        default=256,
+        help="The maximum number of analyzed regions waiting to be inserted, after which the analysis waits for"
+            " the database.")
+
+    parser.add_argument('--region-batch-size',
+        type=int,
+        default=64,
+        help="The maximum number of regions inserted at once.")
+
+    parser.add_argument('--profile',
+        type=Path,
+        help="Write a JSON trace of the wall time, CPU time and peak memory of each stage, scan and region in a"
+            " file.")
+
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        start_trace(args.profile)
+
+    scan_paths = [Path(args.scan)] if args.scan is not None else find_scan_paths(args.batch)
+
+    if args.registration_cache is not None:
+        registration_cache = RegistrationCache(args.registration_cache, int(args.registration_cache_size * 1024 ** 3))
+    else:
+        registration_cache = None
+
+    if args.atlas_index and args.registration_cache is None:
+        print_warning("The atlas index is only used along with the registration cache.")
+
+    if args.atlas_index:
+        label_index_cache = get_registered_label_index_cache(Path(args.atlas_image))
+    else:
+        label_index_cache = None
+
+    options = AnalysisOptions(
+        args.jobs,
+        registration_cache,
+        tuple(args.mesh_levels),
+        label_index_cache,
+        args.lattice_meshes,
+    )
+
+    with trace_span('load_atlas'):
+        atlas_dictionary = load_atlas_dictionary(Path(args.atlas_dictionary))
+        atlas_image      = load_nifti_image(Path(args.atlas_image))
+
+    print_atlas_regions(atlas_dictionary)
+
+    # The queue is bounded so that the analysis waits for the database instead of accumulating regions.
+    queue: Queue[WriterMessage] = Queue(maxsize=args.queue_size)
+    failures: list[str] = []
+    finished = threading.Event()
+
+    writer = threading.Thread(target=write_scans, args=(queue, args.region_batch_size, failures, finished))
+    writer.start()
+
+    def send(message: WriterMessage):
+        # Do not wait forever if the writer stopped, for instance if the database is not reachable.
+        while True:
+            try:
+                return queue.put(message, timeout=1)
+            except Full:
+                if not writer.is_alive():
+                    print_error_exit("The database writer stopped unexpectedly.")
+
+    output = open(args.output, 'w') if args.output is not None else None
+
+    # Keep the region workers between scans instead of starting a pool for each scan.
+    region_executor = create_region_executor(args.jobs) if args.jobs > 1 else None
+
+    try:
+        for scan_path in scan_paths:
+            try:
+                metadata = create_scan_metadata(scan_path, load_nifti_image(scan_path))
+            except (Exception, SystemExit) as error:
+                print_warning(f"Could not load scan '{scan_path}': {error}")
+                failures.append(scan_path.name)
+                continue
+
+            send(ScanStart(metadata))
+
+            try:
+                scan = analyze_scan(atlas_dictionary, atlas_image, scan_path, options, send, region_executor)
+            except (Exception, SystemExit) as error:
+                print_warning(f"Could not analyze scan '{scan_path}': {error}")
+                send(ScanEnd(metadata.file_name, None))
+                continue
+
+            send(ScanEnd(metadata.file_name, hash_scan(scan)))
+
+            if output is not None:
+                output.write(scan.model_dump_json() + '\n')
+                output.flush()
+    finally:
+        if writer.is_alive():
+            send(None)
+            writer.join()
+
+        if region_executor is not None:
+            region_executor.shutdown()
+
+        if output is not None:
+            output.close()
+
+    if not finished.is_set():
+        print_error_exit("The database writer stopped unexpectedly.")
+
+    print(f"Analyzed and inserted {len(scan_paths) - len(failures)} of {len(scan_paths)} scans.")
+
+    if failures != []:
+        print_error_exit("Failed scans:\n" + '\n'.join(f"- {file_name}" for file_name in failures))
+
+
+def write_scans(
+    queue: Queue[WriterMessage],
+    region_batch_size: int,
+    failures: list[str],
+    finished: threading.Event,
+):
+    """
+    Insert the scans received from the analysis until the end message. The regions are inserted in
+    batches as they arrive, or as soon as the analysis is slower than the database, and each scan
+    is committed once all its regions are inserted, replacing the scan previously inserted with the
+    same file name. A scan that fails is rolled back and added to the failures, and its following
+    messages are ignored.
+    """
+
+    with Session(get_engine()) as db:
+        # File name and identifier of the scan being inserted, if it did not fail.
+        file_name: str | None = None
+        scan_id: int | None = None
+        pending_regions: list[ScanRegion] = []
+
+        while True:
+            message = queue.get()
+            if message is None:
+                finished.set()
+                return
+
+            try:
+                match message:
+                    case ScanStart(metadata=metadata):
+                        file_name = metadata.file_name
+                        pending_regions = []
+                        delete_scans(db, [metadata.file_name])
+                        scan_id, = insert_scan_records(db, [metadata])
+                    case ScanRegion() if scan_id is not None:
+                        pending_regions.append(message)
+                        if len(pending_regions) >= region_batch_size or queue.empty():
+                            insert_scan_regions(db, [(scan_id, region) for region in pending_regions])
+                            pending_regions = []
+                    case ScanEnd(content_hash=None) if file_name is not None:
+                        db.rollback()
+                        failures.append(file_name)
+                        file_name, scan_id = None, None
+                    case ScanEnd(content_hash=str(content_hash)) if scan_id is not None:
+                        insert_scan_regions(db, [(scan_id, region) for region in pending_regions])
+                        update_scan_content_hash(db, scan_id, content_hash)
+                        update_region_aggregates(db, [scan_id])
+                        db.commit()
+                        print(f"Inserted scan '{file_name}'.")
+                        file_name, scan_id = None, None
+                    case _:
+                        pass
+            except Exception as error:
+                db.rollback()
+                if file_name is not None:
+                    print_warning(f"Could not insert scan '{file_name}': {error}")
+                    failures.append(file_name)
+
+                file_name, scan_id = None, None
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,61 @@
 #!/usr/bin/env python
 
 import argparse
-import json
+import glob
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
+from itertools import repeat
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
+from typing import Any
 
 import numpy as np
-
-from brain_region_database.atlas import AtlasRegion, load_atlas_dictionary, print_atlas_regions
-from brain_region_database.nifti import NDArray3, NiftiImage, ants_to_nib, get_voxel_size, nib_to_ants, load_nifti_image
-from brain_region_database.process.registration import register_nifti
-from brain_region_database.process.vectorization import compute_nifti_mask_mesh
-from brain_region_database.scan import Point3D, Scan, ScanRegion
+from nibabel.nifti1 import Nifti1Header, Nifti1Image
+
+from brain_region_database.atlas import Atlas, AtlasRegion, load_atlas_dictionary, print_atlas_regions
+from brain_region_database.nifti import (
+    NDArray3,
+    NiftiImage,
+    ants_to_nib,
+    get_nifti_data,
+    get_voxel_size,
+    load_nifti_image,
+    nib_to_ants,
+)
+from brain_region_database.process.label_index import (
+    LabelIndexCache,
+    get_registered_label_index_cache,
+    hash_registered_label_index,
+    index_labels,
+)
+from brain_region_database.process.parallel import SharedArray, attach_shared_array, share_array
+from brain_region_database.process.registration import (
+    DEFAULT_REGISTRATION_CACHE_SIZE,
+    RegistrationCache,
+    apply_registration_transforms,
+    compute_registration_transforms,
+    hash_registration,
+    hash_transforms,
+)
+from brain_region_database.process.statistics import LabelStatistics, compute_group_statistics
+from brain_region_database.process.vectorization import (
+    DEFAULT_MESH_LEVELS,
+    compute_mesh_lattice,
+    compute_mesh_levels,
+    compute_nifti_mask_mesh,
+)
+from brain_region_database.profiling import (
+    TraceSpan,
+    add_trace_spans,
+    collect_trace_spans,
+    is_tracing,
+    start_trace,
+    trace_span,
+)
+from brain_region_database.scan import Point3D, Scan, ScanMetadata, ScanRegion, ScanRegionLevel, write_scan
+from brain_region_database.util import print_error_exit, print_warning
 
 # ruff: noqa
 # analyze-scan-regions --atlas-image ../atlases/mni_icbm152_nlin_sym_09c_CerebrA_nifti/mni_icbm152_CerebrA_tal_nlin_sym_09c.nii --atlas-dictionary ../atlases/mni_icbm152_nlin_sym_09c_CerebrA_nifti/CerebrA_LabelDetails.csv --scan ../../COMP5411/demo_587630_V1_t1_001.nii
@@ -30,104 +75,456 @@ def main() -> None:
         required=True,
         help="The brain atlas NIfTI image.")
 
-    parser.add_argument('--scan',
-        required=True,
+    scan_group = parser.add_mutually_exclusive_group(required=True)
+
+    scan_group.add_argument('--scan',
         help="The brain scan NIfTI image.")
 
+    scan_group.add_argument('--batch',
+        help="A directory of brain scan NIfTI images, a glob pattern, or a text manifest with one scan path per"
+            " line. The atlas is loaded once and each scan is written as one JSON line in the output file.")
+
     parser.add_argument('--output',
         type=Path,
-        help="Print the scan information JSON in a file instead of the console.")
+        help="Print the scan information JSON in a file instead of the console. Files with the '.npz' extension"
+            " are written in a binary format instead.")
+
+    parser.add_argument('--jobs',
+        type=int,
+        default=1,
+        help="The number of processes used to process the regions in parallel, or the scans in batch mode.")
+
+    parser.add_argument('--registration-cache',
+        type=Path,
+        help="A directory in which to cache the registration transforms, so that the scans already registered"
+            " on the atlas are not registered again.")
+
+    parser.add_argument('--registration-cache-size',
+        type=float,
+        default=DEFAULT_REGISTRATION_CACHE_SIZE / 1024 ** 3,
+        help="The maximum size of the registration cache in gigabytes.")
+
+    parser.add_argument('--atlas-index',
+        action='store_true',
+        help="Cache the voxels of each region of the registered atlas in a directory next to the atlas image, so"
+            " that the regions are not searched again when a scan whose registration is cached is analyzed again."
+            " Requires --registration-cache.")
+
+    parser.add_argument('--mesh-levels',
+        type=float,
+        nargs='*',
+        default=list(DEFAULT_MESH_LEVELS),
+        help="The ratios of faces of the simplified meshes computed for each region in addition to the full"
+            " mesh.")
+
+    parser.add_argument('--lattice-meshes',
+        action='store_true',
+        help="Write the vertices of the full meshes in JSON as compact integer coordinates on the voxel lattice"
+            " of the registered atlas, which are decoded to world coordinates when the scan is read.")
+
+    parser.add_argument('--profile',
+        type=Path,
+        help="Write a JSON trace of the wall time, CPU time and peak memory of each stage and each region in a"
+            " file.")
 
     args = parser.parse_args()
 
+    if args.profile is not None:
+        start_trace(args.profile)
+
     atlas_dictionary_path = Path(args.atlas_dictionary)
     atlas_image_path      = Path(args.atlas_image)
-    scan_path             = Path(args.scan)
 
-    atlas_dictionary = load_atlas_dictionary(atlas_dictionary_path)
-    atlas_image      = load_nifti_image(atlas_image_path)
-    scan_image       = load_nifti_image(scan_path)
+    if args.registration_cache is not None:
+        registration_cache = RegistrationCache(args.registration_cache, int(args.registration_cache_size * 1024 ** 3))
+    else:
+        registration_cache = None
 
-    print_atlas_regions(atlas_dictionary)
+    if args.atlas_index and args.registration_cache is None:
+        print_warning("The atlas index is only used along with the registration cache.")
 
-    atlas_image = ants_to_nib(register_nifti(
-        nib_to_ants(atlas_image),
-        nib_to_ants(scan_image),
-        'nearest',
-    ))
+    if args.atlas_index:
+        label_index_cache = get_registered_label_index_cache(atlas_image_path)
+    else:
+        label_index_cache = None
+
+    options = AnalysisOptions(
+        args.jobs,
+        registration_cache,
+        tuple(args.mesh_levels),
+        label_index_cache,
+        args.lattice_meshes,
+    )
 
-    atlas_data: NDArray3[np.float32] = atlas_image.get_fdata()
-    scan_data:  NDArray3[np.float32] = scan_image.get_fdata()
+    if args.batch is not None:
+        if args.output is None:
+            print_error_exit("An output file is needed to analyze a batch of scans.")
 
-    regions: list[ScanRegion] = []
+        return analyze_batch(
+            atlas_dictionary_path,
+            atlas_image_path,
+            find_scan_paths(args.batch),
+            args.output,
+            options,
+        )
 
-    for region in atlas_dictionary.regions:
-        print(f"Processing region '{region.name}' ({region.value})")
+    with trace_span('load_atlas'):
+        atlas_dictionary = load_atlas_dictionary(atlas_dictionary_path)
+        atlas_image      = load_nifti_image(atlas_image_path)
 
-        regions.append(collect_region_statistics(atlas_image, region, atlas_data, scan_data))
+    print_atlas_regions(atlas_dictionary)
 
-    scan = Scan(
+    scan = analyze_scan(atlas_dictionary, atlas_image, Path(args.scan), options)
+
+    with trace_span('write_scan'):
+        if args.output:
+            print(f"Writing scan information to '{args.output}'.")
+            write_scan(scan, args.output)
+        else:
+            print(scan.model_dump_json(indent=4))
+
+
+@dataclass
+class AnalysisOptions:
+    # Number of processes used to process the regions of a scan, or the scans of a batch.
+    jobs: int = 1
+    registration_cache: RegistrationCache | None = None
+    # Ratios of faces of the simplified meshes of each region.
+    mesh_levels: tuple[float, ...] = DEFAULT_MESH_LEVELS
+    # Cache of the label index of the registered atlas, which is only used with the registration cache.
+    label_index_cache: LabelIndexCache | None = None
+    # Whether the full meshes are written as integer lattice coordinates.
+    lattice_meshes: bool = False
+
+
+def analyze_scan(
+    atlas_dictionary: Atlas,
+    atlas_image: NiftiImage,
+    scan_path: Path,
+    options: AnalysisOptions,
+    on_region: Callable[[ScanRegion], None] | None = None,
+    region_executor: ProcessPoolExecutor | None = None,
+) -> Scan:
+    """
+    Analyze the regions of a scan. If a callback is given, each region is passed to it as soon as
+    it is collected, in the atlas order. If a pool created with `create_region_executor` is given,
+    the regions are processed in this pool instead of a pool created for the scan.
+    """
+
+    with trace_span('analyze_scan', scan=scan_path.name):
+        scan_image = load_nifti_image(scan_path)
+
+        with trace_span('register_nifti'):
+            ants_atlas_image = nib_to_ants(atlas_image)
+            ants_scan_image  = nib_to_ants(scan_image)
+
+            if options.registration_cache is not None:
+                registration_key = hash_registration(ants_atlas_image, ants_scan_image)
+            else:
+                registration_key = None
+
+            transforms = compute_registration_transforms(
+                ants_atlas_image,
+                ants_scan_image,
+                options.registration_cache,
+                registration_key,
+            )
+            atlas_image = ants_to_nib(apply_registration_transforms(
+                ants_atlas_image,
+                ants_scan_image,
+                transforms,
+                'nearest',
+            ))
+
+        with trace_span('load_data'):
+            atlas_data = get_nifti_data(atlas_image)
+            scan_data  = get_nifti_data(scan_image)
+
+        print("Computing region statistics...")
+
+        values = [region.value for region in atlas_dictionary.regions]
+
+        # The registered atlas differs for each scan, so its index is keyed by its registration and
+        # transforms rather than by its content, and is only cached if the registration is. The
+        # transforms are hashed as they change if they are computed again after their eviction.
+        if options.label_index_cache is not None and registration_key is not None:
+            label_index_cache = options.label_index_cache
+            label_index_key   = hash_registered_label_index(
+                registration_key,
+                hash_transforms(transforms),
+                'nearest',
+                values,
+            )
+        else:
+            label_index_cache = None
+            label_index_key   = None
+
+        with trace_span('index_labels'):
+            groups = index_labels(atlas_image, values, label_index_cache, label_index_key)
+
+        with trace_span('compute_label_statistics'):
+            label_statistics = compute_group_statistics(groups, scan_data)
+
+        region_statistics: list[tuple[AtlasRegion, LabelStatistics]] = []
+        for region in atlas_dictionary.regions:
+            if region.value not in label_statistics:
+                print_warning(f"Region '{region.name}' ({region.value}) has no voxel in the scan, skipping it.")
+                continue
+
+            region_statistics.append((region, label_statistics[region.value]))
+
+        with trace_span('collect_regions', jobs=options.jobs):
+            if options.jobs > 1:
+                collected_regions = collect_regions_parallel(
+                    atlas_image,
+                    atlas_data,
+                    region_statistics,
+                    options,
+                    region_executor,
+                )
+            else:
+                collected_regions = (
+                    collect_region_statistics(atlas_image, region, statistics, atlas_data, options.mesh_levels)
+                    for region, statistics in region_statistics
+                )
+
+            regions: list[ScanRegion] = []
+            for region in collected_regions:
+                if on_region is not None:
+                    on_region(region)
+
+                regions.append(region)
+
+        metadata = create_scan_metadata(scan_path, scan_image)
+        metadata.lattice = compute_mesh_lattice(atlas_image) if options.lattice_meshes else None
+        return Scan(**metadata.model_dump(), regions=regions)
+
+
+def create_scan_metadata(scan_path: Path, scan_image: NiftiImage) -> ScanMetadata:
+    shape = scan_image.shape
+    return ScanMetadata(
         file_name=scan_path.name,
         file_size=scan_path.stat().st_size,
-        dimensions=f"{scan_data.shape[0]}x{scan_data.shape[1]}x{scan_data.shape[2]}",
+        dimensions=f"{shape[0]}x{shape[1]}x{shape[2]}",
         voxel_size=get_voxel_size(scan_image),
-        regions=regions
     )
 
-    # Convert the scan object to JSON.
-    scan_json = json.dumps(scan.model_dump(), indent=4)
 
-    if args.output:
-        print(f"Writing scan information to '{args.output}'.")
-        with open(args.output, 'w') as f:
-            f.write(scan_json)
+def find_scan_paths(source: str) -> list[Path]:
+    """
+    Find the scan paths of a batch, given either a directory, a text manifest or a glob pattern.
+    """
+
+    path = Path(source)
+    if path.is_dir():
+        scan_paths = sorted(path.glob('*.nii')) + sorted(path.glob('*.nii.gz'))
+    elif path.is_file():
+        with open(path) as file:
+            scan_paths = [path.parent / line.strip() for line in file if line.strip() != '']
+    else:
+        scan_paths = sorted(map(Path, glob.glob(source)))
+
+    if scan_paths == []:
+        print_error_exit(f"No scan found for '{source}'.")
+
+    return scan_paths
+
+
+def analyze_batch(
+    atlas_dictionary_path: Path,
+    atlas_image_path: Path,
+    scan_paths: list[Path],
+    output_path: Path,
+    options: AnalysisOptions,
+):
+    """
+    Analyze a batch of scans and stream each scan as a JSON line in the output file. A scan that
+    fails is reported and does not stop the batch. The scans are processed in parallel, and the
+    regions of each scan sequentially.
+    """
+
+    print(f"Analyzing {len(scan_paths)} scans...")
+
+    failures: list[Path] = []
+    with open(output_path, 'w') as output, ProcessPoolExecutor(
+        max_workers=options.jobs,
+        initializer=init_batch_worker,
+        initargs=(atlas_dictionary_path, atlas_image_path, replace(options, jobs=1), is_tracing()),
+    ) as executor:
+        futures = [executor.submit(analyze_batch_scan, scan_path) for scan_path in scan_paths]
+        for scan_path, future in zip(scan_paths, futures):
+            try:
+                scan_json, spans = future.result()
+            except (Exception, SystemExit) as error:
+                print_warning(f"Could not analyze scan '{scan_path}': {error}")
+                failures.append(scan_path)
+                continue
+
+            add_trace_spans(spans)
+            output.write(scan_json + '\n')
+            output.flush()
+            print(f"Analyzed scan '{scan_path}'.")
+
+    print(f"Analyzed {len(scan_paths) - len(failures)} of {len(scan_paths)} scans.")
+
+    if failures != []:
+        print_error_exit("Failed scans:\n" + '\n'.join(f"- {scan_path}" for scan_path in failures))
+
+
+# Atlas of a batch worker process, loaded once for all the scans of the worker.
+worker_batch_atlas: tuple[Atlas, NiftiImage, AnalysisOptions] | None = None
+
+
+def init_batch_worker(
+    atlas_dictionary_path: Path,
+    atlas_image_path: Path,
+    options: AnalysisOptions,
+    profile: bool,
+):
+    global worker_batch_atlas
+    if profile:
+        start_trace()
+
+    worker_batch_atlas = (
+        load_atlas_dictionary(atlas_dictionary_path),
+        load_nifti_image(atlas_image_path),
+        options,
+    )
+
+
+def analyze_batch_scan(scan_path: Path) -> tuple[str, list[TraceSpan]]:
+    assert worker_batch_atlas is not None
+    atlas_dictionary, atlas_image, options = worker_batch_atlas
+    scan_json = analyze_scan(atlas_dictionary, atlas_image, scan_path, options).model_dump_json()
+    return scan_json, collect_trace_spans()
+
+
+@dataclass
+class SharedAtlas:
+    """
+    Registered atlas of a scan whose label volume is shared with the region workers, which is cheap
+    to send along with each region.
+    """
+
+    data: SharedArray
+    affine: np.ndarray
+    header: Nifti1Header
+    mesh_levels: tuple[float, ...]
+
+
+# Atlas of the scan whose regions a worker process is collecting, attached to the shared memory of the main process.
+worker_atlas: tuple[SharedArray, SharedMemory, NiftiImage, np.ndarray] | None = None
+
+
+def create_region_executor(jobs: int) -> ProcessPoolExecutor:
+    """
+    Create a pool of processes collecting the regions of scans, which can be kept between scans.
+    """
+
+    return ProcessPoolExecutor(max_workers=jobs, initializer=init_region_worker, initargs=(is_tracing(),))
+
+
+def collect_regions_parallel(
+    atlas_image: NiftiImage,
+    atlas_data: NDArray3[Any],
+    region_statistics: list[tuple[AtlasRegion, LabelStatistics]],
+    options: AnalysisOptions,
+    region_executor: ProcessPoolExecutor | None = None,
+) -> Iterator[ScanRegion]:
+    """
+    Collect the regions in a pool of processes, either the given one or one created for the scan.
+    The label volume is shared with the workers once instead of being sent with each region, and
+    the regions are yielded in the atlas order as soon as they are collected.
+    """
+
+    if region_executor is not None:
+        executor_context = nullcontext(region_executor)
     else:
-        print(scan_json)
+        executor_context = create_region_executor(options.jobs)
 
+    with share_array(atlas_data) as shared_atlas_data, executor_context as executor:
+        shared_atlas = SharedAtlas(shared_atlas_data, atlas_image.affine, atlas_image.header, options.mesh_levels)
+        for region, spans in executor.map(collect_region_worker, repeat(shared_atlas), region_statistics):
+            add_trace_spans(spans)
+            yield region
+
+
+def init_region_worker(profile: bool):
+    if profile:
+        start_trace()
+
+
+def collect_region_worker(
+    shared_atlas: SharedAtlas,
+    region_statistics: tuple[AtlasRegion, LabelStatistics],
+) -> tuple[ScanRegion, list[TraceSpan]]:
+    global worker_atlas
+
+    # Attach to the label volume of a new scan, and release the one of the previous scan.
+    if worker_atlas is None or worker_atlas[0] != shared_atlas.data:
+        if worker_atlas is not None:
+            previous_memory = worker_atlas[1]
+            worker_atlas = None
+            previous_memory.close()
+
+        memory, atlas_data = attach_shared_array(shared_atlas.data)
+        atlas_image = Nifti1Image(atlas_data, shared_atlas.affine, shared_atlas.header)
+        worker_atlas = (shared_atlas.data, memory, atlas_image, atlas_data)
+
+    _, _, atlas_image, atlas_data = worker_atlas
+    region, statistics = region_statistics
+    scan_region = collect_region_statistics(atlas_image, region, statistics, atlas_data, shared_atlas.mesh_levels)
+    return scan_region, collect_trace_spans()
 
 
 def collect_region_statistics(
     original: NiftiImage,
     region: AtlasRegion,
-    atlas_data: NDArray3[np.float32],
-    scan_data: NDArray3[np.float32],
+    statistics: LabelStatistics,
+    atlas_data: NDArray3[Any],
+    mesh_levels: tuple[float, ...] = (),
 ) -> ScanRegion:
-    # Create the mask of the region.
-    region_mask = (atlas_data == region.value)
+    print(f"Processing region '{region.name}' ({region.value})")
 
-    # Get coordinates of the region
-    region_coordinates = np.argwhere(region_mask)
+    with trace_span('collect_region_statistics', region=region.name, value=region.value):
+        with trace_span('compute_nifti_mask_mesh'):
+            vertices, faces = compute_nifti_mask_mesh(original, atlas_data, region.value, statistics.bounding_box)
 
-    # Apply the region mask to the scan data.
-    region_scan_data = scan_data[region_mask]
+        with trace_span('compute_mesh_levels', faces=len(faces)):
+            levels = compute_mesh_levels(vertices, faces, mesh_levels)
 
-    # Compute centroid.
-    centroid = np.mean(region_coordinates, axis=0)
+        with trace_span('create_scan_region'):
+            return create_scan_region(region, statistics, vertices, faces, levels)
 
-    # Compute bounding box.
-    min_bounding_box = np.min(region_coordinates, axis=0).astype(int)
-    max_bounding_box = np.max(region_coordinates, axis=0).astype(int)
 
-    vertices, faces = compute_nifti_mask_mesh(original, region_mask)
+def create_scan_region(
+    region: AtlasRegion,
+    statistics: LabelStatistics,
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    levels: list[tuple[float, np.ndarray, np.ndarray]],
+) -> ScanRegion:
+    min_bounding_box, max_bounding_box = statistics.bounding_box
 
     return ScanRegion(
         name=region.name,
         value=region.value,
-        voxel_count=np.sum(region_mask).item(),
-        mean_intensity=np.mean(region_scan_data).item(),
-        std_intensity=np.std(region_scan_data).item(),
-        min_intensity=np.min(region_scan_data).item(),
-        max_intensity=np.max(region_scan_data).item(),
-        median_intensity=np.median(region_scan_data).item(),
-        centroid=Point3D.from_array(centroid),
+        voxel_count=statistics.voxel_count,
+        mean_intensity=statistics.mean_intensity,
+        std_intensity=statistics.std_intensity,
+        min_intensity=statistics.min_intensity,
+        max_intensity=statistics.max_intensity,
+        median_intensity=statistics.median_intensity,
+        centroid=Point3D.from_array(statistics.centroid),
         bounding_box=(
             Point3D.from_array(min_bounding_box),
             Point3D.from_array(max_bounding_box),
         ),
-        shape=(
-            [tuple(row) for row in vertices],
-            [tuple(row) for row in faces],
-        ),
+        shape=(vertices, faces),
+        levels=[
+            ScanRegionLevel(ratio=ratio, shape=(level_vertices, level_faces))
+            for ratio, level_vertices, level_faces in levels
+        ],
     )
 
 
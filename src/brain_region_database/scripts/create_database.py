@@ -1,14 +1,16 @@
 #!/usr/bin/env python
 
 import argparse
+from pathlib import Path
 
 from sqlalchemy import Engine, inspect, text
 from sqlalchemy.dialects.postgresql import dialect as postgresql_dialect
-from sqlalchemy.schema import CreateTable
+from sqlalchemy.schema import CreateIndex, CreateTable
 
 from brain_region_database.database.engine import get_engine
 from brain_region_database.database.models import Base
-from brain_region_database.util import print_error_exit
+from brain_region_database.profiling import start_trace, trace_span
+from brain_region_database.util import print_error_exit, print_warning
 
 
 def create_database(engine: Engine):
@@ -18,6 +20,17 @@ def create_database(engine: Engine):
             connection.execute(text("CREATE EXTENSION IF NOT EXISTS postgis;"))
             connection.commit()
 
+        try:
+            with engine.connect() as connection:
+                print("Enabling PostGIS SFCGAL extension...")
+                connection.execute(text("CREATE EXTENSION IF NOT EXISTS postgis_sfcgal;"))
+                connection.commit()
+        except Exception as error:
+            print_warning(
+                f"Could not enable the PostGIS SFCGAL extension, point containment and box intersection queries will"
+                f" fail:\n{error}"
+            )
+
         if len(inspect(engine).get_table_names()) > 0:
             print("Dropping existing tables...")
             Base.metadata.drop_all(engine)
@@ -32,6 +45,8 @@ def print_create_database() -> None:
     for table in Base.metadata.sorted_tables:
         statement = CreateTable(table)
         print(statement.compile(dialect=dialect))
+        for index in sorted(table.indexes, key=lambda index: index.name or ''):
+            print(CreateIndex(index).compile(dialect=dialect))
 
 
 def main() -> None:
@@ -43,14 +58,25 @@ def main() -> None:
         help="Print the SQL statements instead of executing them."
     )
 
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        help="Write a JSON trace of the wall time, CPU time and peak memory of each stage in a file."
+    )
+
     args = parser.parse_args()
 
+    if args.profile is not None:
+        start_trace(args.profile)
+
     if args.print_only:
         print_create_database()
         return
 
     engine = get_engine()
-    create_database(engine)
+    with trace_span('create_database'):
+        create_database(engine)
+
     print("Success!")
 
 
@@ -1,14 +1,31 @@
 #!/usr/bin/env python
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import nibabel as nib
+import numpy as np
 from nibabel.nifti1 import Nifti1Image
 
-from brain_region_database.atlas import load_atlas_dictionary, print_atlas_regions
-from brain_region_database.nifti import has_same_dims, load_nifti_image, resample_to_same_dims
-from brain_region_database.util import print_error_exit
+from brain_region_database.atlas import AtlasRegion, load_atlas_dictionary, print_atlas_regions
+from brain_region_database.nifti import (
+    NiftiImage,
+    get_nifti_data,
+    has_same_dims,
+    load_nifti_image,
+    resample_to_same_dims,
+)
+from brain_region_database.process.label_index import (
+    LabelIndexCache,
+    get_atlas_label_index_cache,
+    hash_label_index,
+    load_label_index,
+    store_label_index,
+)
+from brain_region_database.process.statistics import LabelGroups, get_group_coordinates, group_labels
+from brain_region_database.profiling import start_trace, trace_span
+from brain_region_database.util import print_error_exit, print_warning
 
 # ruff: noqa
 # extract-scan-regions --atlas-image ../atlases/mni_icbm152_nlin_sym_09c_CerebrA_nifti/mni_icbm152_CerebrA_tal_nlin_sym_09c.nii --atlas-dictionary ../atlases/mni_icbm152_nlin_sym_09c_CerebrA_nifti/CerebrA_LabelDetails.csv --scan ../../COMP5411/demo_587630_V1_t1_001.nii
@@ -31,25 +48,84 @@ def main() -> None:
         required=True,
         help="The brain scan NIfTI image.")
 
-    parser.add_argument('--output-dir',
-        required=True,
+    output_group = parser.add_mutually_exclusive_group(required=True)
+
+    output_group.add_argument('--output-dir',
         help="The output directory in which to write the region files.")
 
+    output_group.add_argument('--output-file',
+        type=Path,
+        help="A single NPZ file in which to write the voxels of all the regions, as the flat voxel indices and"
+            " intensities of each region, along with the affine and shape of the scan.")
+
+    parser.add_argument('--crop',
+        action='store_true',
+        help="Crop each region file to the bounding box of the region. Only used with --output-dir.")
+
+    parser.add_argument('--compress',
+        action='store_true',
+        help="Write the region files as compressed '.nii.gz' files. Only used with --output-dir.")
+
+    parser.add_argument('--atlas-index',
+        action='store_true',
+        help="Cache the voxels of each atlas region in a directory next to the atlas image, so that the atlas is"
+            " neither resampled nor searched again for the scans that have the same grid.")
+
+    parser.add_argument('--jobs',
+        type=int,
+        default=1,
+        help="The number of threads used to write the region files. Only used with --output-dir.")
+
+    parser.add_argument('--profile',
+        type=Path,
+        help="Write a JSON trace of the wall time, CPU time and peak memory of each stage in a file.")
+
     args = parser.parse_args()
 
-    atlas_dictionary = load_atlas_dictionary(Path(args.atlas_dictionary))
-    atlas_image      = load_nifti_image(Path(args.atlas_image))
-    scan_image       = load_nifti_image(Path(args.scan))
-    output_dir_path  = Path(args.output_dir)
+    if args.output_file is not None:
+        options = [option for option, is_set in (
+            ('--crop',     args.crop),
+            ('--compress', args.compress),
+            ('--jobs',     args.jobs != 1),
+        ) if is_set]
+
+        if options:
+            print_error_exit(f"Option(s) {', '.join(options)} can only be used with --output-dir.")
+
+    if args.profile is not None:
+        start_trace(args.profile)
+
+    with trace_span('load_images'):
+        atlas_dictionary = load_atlas_dictionary(Path(args.atlas_dictionary))
+        atlas_image      = load_nifti_image(Path(args.atlas_image))
+        scan_image       = load_nifti_image(Path(args.scan))
 
     print_atlas_regions(atlas_dictionary)
 
-    if not has_same_dims(scan_image, atlas_image):
-        print("Resampling atlas to the image space.")
-        atlas_image = resample_to_same_dims(atlas_image, scan_image, 'nearest')
+    values = [region.value for region in atlas_dictionary.regions]
+
+    if args.atlas_index:
+        label_index_cache = get_atlas_label_index_cache(Path(args.atlas_image))
     else:
-        print("Atlas is already in the image space.")
+        label_index_cache = None
+
+    with trace_span('group_labels'):
+        groups = group_atlas_labels(atlas_image, scan_image, values, label_index_cache)
+
+    with trace_span('load_data'):
+        scan_data = get_nifti_data(scan_image)
+
+    group_indices = {value: i for i, value in enumerate(groups.values.tolist())}
+    scan_flat_data = scan_data.ravel()
+
+    if args.output_file is not None:
+        with trace_span('write_regions_file'):
+            write_regions_file(args.output_file, scan_image, atlas_dictionary.regions, groups, scan_flat_data)
 
+        print("Success!")
+        return
+
+    output_dir_path = Path(args.output_dir)
     if not output_dir_path.exists():
         if not output_dir_path.parent.exists():
             print_error_exit(f"Parent directory '{output_dir_path.parent}' does not exist.")
@@ -58,27 +134,137 @@ def main() -> None:
         if not output_dir_path.is_dir():
             print_error_exit(f"Path '{output_dir_path}' exists but is not a directory.")
 
-    atlas_data = atlas_image.get_fdata()
-    scan_data  = scan_image.get_fdata()
+    suffix = '.nii.gz' if args.compress else '.nii'
 
-    for region in atlas_dictionary.regions:
+    def write_region(region: AtlasRegion):
         print(f"Processing region '{region.name}' ({region.value})")
 
-        # Create the mask for this region.
-        region_mask = (atlas_data == region.value)
-
-        # Apply the mask to the scan data.
-        region_data = scan_data * region_mask
+        if region.value not in group_indices:
+            print_warning(f"Region '{region.name}' ({region.value}) has no voxel in the scan.")
+            if args.crop:
+                return
 
-        # Create a new NIfTI image with the region data.
-        region_nifti = Nifti1Image(region_data, scan_image.affine, scan_image.header)  # type: ignore
+        region_nifti = create_region_image(
+            scan_image,
+            groups,
+            group_indices.get(region.value),
+            scan_flat_data,
+            args.crop,
+        )
 
         # Save the region as a NIfTI file.
-        region_path = output_dir_path / f"{region.name}.nii"
+        region_path = output_dir_path / f"{region.name}{suffix}"
         nib.save(region_nifti, region_path)  # type: ignore
 
+    # The regions are written by threads, so they are traced as a single stage.
+    with trace_span('write_regions', jobs=args.jobs), ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        # Consume the results to propagate the errors of the threads.
+        list(executor.map(write_region, atlas_dictionary.regions))
+
     print("Success!")
 
 
+def group_atlas_labels(
+    atlas_image: NiftiImage,
+    scan_image: NiftiImage,
+    values: list[int],
+    cache: LabelIndexCache | None,
+) -> LabelGroups:
+    """
+    Group the voxels of all the atlas regions in the scan grid at once instead of comparing the
+    atlas to each region. The cache is keyed by the original atlas and the scan grid, so a cached
+    index also saves the resampling of the atlas.
+    """
+
+    scan_shape  = scan_image.shape[:3]
+    scan_affine = scan_image.affine  # type: ignore
+
+    key: str | None = None
+    if cache is not None:
+        key = hash_label_index(atlas_image, scan_shape, scan_affine, values)
+        groups = load_label_index(cache, key, scan_shape)
+        if groups is not None:
+            print("Using cached atlas label index.")
+            return groups
+
+    if not has_same_dims(scan_image, atlas_image):
+        print("Resampling atlas to the image space.")
+        atlas_image = resample_to_same_dims(atlas_image, scan_image, 'nearest')
+    else:
+        print("Atlas is already in the image space.")
+
+    groups = group_labels(get_nifti_data(atlas_image), values)
+
+    if cache is not None and key is not None:
+        return store_label_index(cache, key, groups)
+
+    return groups
+
+
+def create_region_image(
+    scan_image: NiftiImage,
+    groups: LabelGroups,
+    group_index: int | None,
+    scan_flat_data: np.ndarray,
+    crop: bool,
+) -> Nifti1Image:
+    """
+    Create the image of a region in the data type of the scan, either with the shape of the scan or
+    cropped to the bounding box of the region with a translated affine.
+    """
+
+    if group_index is None:
+        coordinates = np.empty((0, 3), np.int64)
+        indices     = np.empty(0, np.int64)
+    else:
+        coordinates = get_group_coordinates(groups, group_index)
+        indices     = groups.indices[groups.offsets[group_index]:groups.offsets[group_index + 1]]
+
+    if crop:
+        start = coordinates.min(axis=0)
+        shape = coordinates.max(axis=0) - start + 1
+    else:
+        start = np.zeros(3, np.int64)
+        shape = np.array(groups.shape[:3])
+
+    region_data = np.zeros(tuple(shape), dtype=scan_flat_data.dtype)
+    region_data[tuple((coordinates - start).T)] = scan_flat_data[indices]
+
+    # Translate the affine to the first voxel of the crop.
+    affine = scan_image.affine.copy()  # type: ignore
+    affine[:3, 3] = affine[:3, :3] @ start + affine[:3, 3]
+
+    return Nifti1Image(region_data, affine, scan_image.header)  # type: ignore
+
+
+def write_regions_file(
+    path: Path,
+    scan_image: NiftiImage,
+    regions: list[AtlasRegion],
+    groups: LabelGroups,
+    scan_flat_data: np.ndarray,
+):
+    """
+    Write the voxels of all the regions in a single NPZ file. The voxels of the region `values[i]`
+    are the flat C-order indices `indices[offsets[i]:offsets[i + 1]]` of the scan, with the
+    intensities at the same positions in `intensities`.
+    """
+
+    print(f"Writing regions to '{path}'.")
+
+    names = {region.value: region.name for region in regions}
+
+    np.savez(
+        path,
+        names=np.array([names[value] for value in groups.values.tolist()], dtype=str),
+        values=groups.values,
+        offsets=groups.offsets,
+        indices=groups.indices,
+        intensities=scan_flat_data[groups.indices],
+        shape=np.array(groups.shape),
+        affine=scan_image.affine,  # type: ignore
+    )
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+from sqlalchemy.orm import Session
+
+from brain_region_database.atlas import load_atlas_dictionary, print_atlas_regions
+from brain_region_database.database.engine import get_engine
+from brain_region_database.nifti import load_nifti_image
+from brain_region_database.process.label_index import get_registered_label_index_cache
+from brain_region_database.process.registration import DEFAULT_REGISTRATION_CACHE_SIZE, RegistrationCache
+from brain_region_database.process.vectorization import DEFAULT_MESH_LEVELS
+from brain_region_database.profiling import start_trace, trace_span
+from brain_region_database.scan import hash_scan
+from brain_region_database.scripts.analyze_scan_regions import (
+    AnalysisOptions,
+    analyze_scan,
+    create_region_executor,
+)
+from brain_region_database.scripts.insert_scan import insert_scan_batch
+from brain_region_database.util import print_error_exit, print_warning
+
+SCAN_SUFFIXES = ('.nii', '.nii.gz')
+
+# Subdirectories of the inbox in which the scans are moved once claimed, inserted, or failed.
+PROCESSING_DIRECTORY = 'processing'
+DONE_DIRECTORY       = 'done'
+FAILED_DIRECTORY     = 'failed'
+
+
+def is_scan_file(path: Path) -> bool:
+    return path.is_file() and path.name.endswith(SCAN_SUFFIXES)
+
+
+def find_queued_scans(inbox_path: Path, settle_time: float) -> list[Path]:
+    """
+    Find the scans waiting in the inbox, oldest first, ignoring the files modified too recently as
+    they may still be being written.
+    """
+
+    now = time.time()
+    scan_paths = [
+        path for path in inbox_path.iterdir()
+        if is_scan_file(path) and now - path.stat().st_mtime >= settle_time
+    ]
+
+    return sorted(scan_paths, key=lambda path: path.stat().st_mtime)
+
+
+def claim_scan(inbox_path: Path, scan_path: Path) -> Path | None:
+    """
+    Move a scan from the inbox to the processing directory. Return `None` if another worker claimed
+    it first.
+    """
+
+    claimed_path = inbox_path / PROCESSING_DIRECTORY / scan_path.name
+    try:
+        scan_path.rename(claimed_path)
+    except FileNotFoundError:
+        return None
+
+    # Record the time of the claim, which is used to find the scans left by a stopped worker.
+    os.utime(claimed_path)
+
+    return claimed_path
+
+
+def requeue_stale_scans(inbox_path: Path, stale_time: float) -> int:
+    """
+    Move the scans claimed too long ago back to the inbox, as the worker that claimed them was
+    stopped before finishing them. Return the number of requeued scans.
+    """
+
+    now = time.time()
+    requeued_count = 0
+    for scan_path in (inbox_path / PROCESSING_DIRECTORY).iterdir():
+        if not is_scan_file(scan_path) or now - scan_path.stat().st_mtime < stale_time:
+            continue
+
+        try:
+            scan_path.rename(inbox_path / scan_path.name)
+        except FileNotFoundError:
+            # Another worker requeued or finished the scan in the meantime.
+            continue
+
+        print_warning(f"Requeued scan '{scan_path.name}' left in processing by a stopped worker.")
+        requeued_count += 1
+
+    return requeued_count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog='ingest_worker',
+        description="Watch an inbox directory for NIfTI scans, then analyze and insert each of them in the database,"
+            " keeping the atlas and the database connections loaded between scans.",
+    )
+
+    parser.add_argument('--atlas-dictionary',
+        required=True,
+        help="The brain atlas CSV dictionary.")
+
+    parser.add_argument('--atlas-image',
+        required=True,
+        help="The brain atlas NIfTI image.")
+
+    parser.add_argument('--inbox',
+        required=True,
+        type=Path,
+        help="The directory in which new NIfTI scans are queued. Scans are moved to its 'processing', 'done' and"
+            " 'failed' subdirectories.")
+
+    parser.add_argument('--poll-interval',
+        type=float,
+        default=5.0,
+        help="The number of seconds to wait before checking the inbox again when it is empty.")
+
+    parser.add_argument('--settle-time',
+        type=float,
+        default=5.0,
+        help="The number of seconds a scan must be left unmodified before it is processed.")
+
+    parser.add_argument('--stale-time',
+        type=float,
+        default=3600.0,
+        help="The number of seconds after which a scan left in the 'processing' subdirectory, for instance by a"
+            " worker that crashed, is moved back to the inbox when a worker starts.")
+
+    parser.add_argument('--once',
+        action='store_true',
+        help="Exit once the inbox is empty instead of waiting for new scans.")
+
+    parser.add_argument('--jobs',
+        type=int,
+        default=1,
+        help="The number of processes used to process the regions of each scan in parallel, which are kept"
+            " between scans.")
+
+    parser.add_argument('--registration-cache',
+        type=Path,
+        help="A directory in which to cache the registration transforms.")
+
+    parser.add_argument('--registration-cache-size',
+        type=float,
+        default=DEFAULT_REGISTRATION_CACHE_SIZE / 1024 ** 3,
+        help="The maximum size of the registration cache in gigabytes.")
+
+    parser.add_argument('--atlas-index',
+        action='store_true',
+        help="Cache the voxels of each region of the registered atlas in a directory next to the atlas image, which"
+            " is reused when a scan whose registration is cached is analyzed again. Requires --registration-cache.")
+
+    parser.add_argument('--mesh-levels',
+        type=float,
+        nargs='*',
+        default=list(DEFAULT_MESH_LEVELS),
+        help="The ratios of faces of the simplified meshes computed for each region.")
+
+    parser.add_argument('--profile',
+        type=Path,
+        help="Write a JSON trace of the wall time, CPU time and peak memory of each stage, scan and region in a"
+            " file when the worker exits.")
+
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        start_trace(args.profile)
+
+    inbox_path: Path = args.inbox
+    if not inbox_path.is_dir():
+        print_error_exit(f"Inbox '{inbox_path}' is not a directory.")
+
+    for directory in (PROCESSING_DIRECTORY, DONE_DIRECTORY, FAILED_DIRECTORY):
+        (inbox_path / directory).mkdir(exist_ok=True)
+
+    requeue_stale_scans(inbox_path, args.stale_time)
+
+    if args.registration_cache is not None:
+        registration_cache = RegistrationCache(args.registration_cache, int(args.registration_cache_size * 1024 ** 3))
+    else:
+        registration_cache = None
+
+    if args.atlas_index and args.registration_cache is None:
+        print_warning("The atlas index is only used along with the registration cache.")
+
+    if args.atlas_index:
+        label_index_cache = get_registered_label_index_cache(Path(args.atlas_image))
+    else:
+        label_index_cache = None
+
+    options = AnalysisOptions(args.jobs, registration_cache, tuple(args.mesh_levels), label_index_cache)
+
+    atlas_dictionary = load_atlas_dictionary(Path(args.atlas_dictionary))
+    atlas_image      = load_nifti_image(Path(args.atlas_image))
+
+    print_atlas_regions(atlas_dictionary)
+
+    processed_count = 0
+    failed_count    = 0
+    start_time      = time.monotonic()
+
+    # Keep the region workers between scans instead of starting a pool for each scan.
+    region_executor_context = create_region_executor(args.jobs) if args.jobs > 1 else nullcontext()
+
+    with Session(get_engine()) as db, region_executor_context as region_executor:
+        print(f"Watching inbox '{inbox_path}'...")
+
+        while True:
+            queued_paths = find_queued_scans(inbox_path, args.settle_time)
+            if queued_paths == []:
+                if args.once:
+                    break
+
+                time.sleep(args.poll_interval)
+                continue
+
+            scan_path = claim_scan(inbox_path, queued_paths[0])
+            if scan_path is None:
+                continue
+
+            scan_start_time = time.monotonic()
+
+            try:
+                with trace_span('ingest_scan', scan=scan_path.name):
+                    scan = analyze_scan(atlas_dictionary, atlas_image, scan_path, options, None, region_executor)
+                    with trace_span('insert_scan_batch'):
+                        insert_scan_batch(db, [(scan, hash_scan(scan))])
+            except (Exception, SystemExit) as error:
+                db.rollback()
+                print_warning(f"Could not ingest scan '{scan_path.name}': {error}")
+                scan_path.rename(inbox_path / FAILED_DIRECTORY / scan_path.name)
+                failed_count += 1
+                continue
+
+            scan_path.rename(inbox_path / DONE_DIRECTORY / scan_path.name)
+            processed_count += 1
+
+            elapsed_time = time.monotonic() - start_time
+            print(
+                f"Ingested scan '{scan_path.name}' in {time.monotonic() - scan_start_time:.1f}s"
+                f" ({processed_count} ingested, {failed_count} failed,"
+                f" {processed_count / elapsed_time * 3600:.1f} scans per hour,"
+                f" {len(queued_paths) - 1} queued)."
+            )
+
+    print(f"Ingested {processed_count} scans, {failed_count} failed.")
+
+
+if __name__ == '__main__':
+    main()
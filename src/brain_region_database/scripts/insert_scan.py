@@ -1,60 +1,248 @@
 #!/usr/bin/env python
 
 import argparse
-import json
 import sys
+from collections.abc import Iterator
+from itertools import batched
 from pathlib import Path
-from typing import TextIO
 
 from sqlalchemy.orm import Session
 
+from brain_region_database.database.aggregate import update_region_aggregates
 from brain_region_database.database.engine import get_engine
-from brain_region_database.database.query import insert_scan, select_scan
-from brain_region_database.scan import Scan
-from brain_region_database.util import print_error_exit
+from brain_region_database.database.query import (
+    delete_scans,
+    insert_scan_records,
+    insert_scan_regions,
+    insert_scans,
+    select_scan_hashes,
+)
+from brain_region_database.profiling import start_trace, trace_span
+from brain_region_database.scan import Scan, hash_scan, hash_scan_stream, read_scan, read_scan_json_stream
+from brain_region_database.util import print_error_exit, print_warning
+
+SCAN_FILE_SUFFIXES = ('.json', '.jsonl', '.npz')
+
 
+def read_scan_json(text: str) -> Scan:
+    return Scan.model_validate_json(text)
 
-def read_scan_json(text: TextIO) -> Scan:
-    print("Loading scan data...")
-    scan_data = json.load(text)
-    return Scan(**scan_data)
+
+def hash_scan_file_stream(path: Path) -> str:
+    """
+    Hash a JSON scan file incrementally, with the same hash as the scan read at once.
+    """
+
+    with open(path) as file:
+        return hash_scan_stream(*read_scan_json_stream(file))
+
+
+def find_scan_files(paths: list[Path]) -> list[Path]:
+    """
+    Find the scan files among the given files and directories.
+    """
+
+    file_paths: list[Path] = []
+    for path in paths:
+        if not path.exists():
+            print_error_exit(f"File '{path}' not found.")
+
+        if path.is_dir():
+            file_paths.extend(sorted(
+                file_path for file_path in path.iterdir() if file_path.suffix in SCAN_FILE_SUFFIXES
+            ))
+        else:
+            file_paths.append(path)
+
+    return file_paths
+
+
+def read_scan_files(file_paths: list[Path]) -> Iterator[tuple[Scan, str]]:
+    """
+    Read the scans of the given files one by one along with the hash of their content. JSON lines
+    files contain one scan per line. A file that cannot be read is reported and skipped.
+    """
+
+    for file_path in file_paths:
+        print(f"Loading scan data from '{file_path}'...")
+        try:
+            if file_path.suffix == '.jsonl':
+                with open(file_path, 'rb') as file:
+                    for line in file:
+                        if line.strip() != b'':
+                            with trace_span('read_scan', file=file_path.name):
+                                scan = read_scan_json(line.decode())
+
+                            yield scan, hash_scan(scan)
+            elif file_path.suffix == '.npz':
+                with trace_span('read_scan', file=file_path.name):
+                    scan = read_scan(file_path)
+
+                yield scan, hash_scan(scan)
+            else:
+                with trace_span('read_scan', file=file_path.name):
+                    scan = read_scan_json(file_path.read_text())
+
+                yield scan, hash_scan(scan)
+        except Exception as error:
+            print_warning(f"Could not read scan file '{file_path}': {error}")
+
+
+def insert_scan_batch(db: Session, scans: list[tuple[Scan, str]]) -> tuple[int, int]:
+    """
+    Insert a batch of scans in a single transaction. The scans already inserted with the same
+    content are skipped, and those inserted with a different content are replaced. Return the
+    number of inserted and skipped scans.
+    """
+
+    # If a scan appears several times in a batch, only keep its last version.
+    batch_scans = {scan.file_name: (scan, content_hash) for scan, content_hash in scans}
+
+    with trace_span('select_scan_hashes'):
+        inserted_hashes = select_scan_hashes(db, list(batch_scans.keys()))
+
+    new_scans: list[tuple[Scan, str]] = []
+    for file_name, (scan, content_hash) in batch_scans.items():
+        if file_name not in inserted_hashes:
+            print(f"Inserting scan '{file_name}' ({len(scan.regions)} regions).")
+        elif inserted_hashes[file_name] != content_hash:
+            print(f"Replacing scan '{file_name}' ({len(scan.regions)} regions).")
+        else:
+            print(f"Scan '{file_name}' is already inserted, skipping it.")
+            continue
+
+        new_scans.append((scan, content_hash))
+
+    with trace_span('delete_scans'):
+        delete_scans(db, [scan.file_name for scan, _ in new_scans if scan.file_name in inserted_hashes])
+
+    with trace_span('insert_scans', scans=len(new_scans)):
+        insert_scans(db, [scan for scan, _ in new_scans], [content_hash for _, content_hash in new_scans])
+
+    with trace_span('commit'):
+        db.commit()
+
+    return len(new_scans), len(batch_scans) - len(new_scans)
+
+
+def insert_scan_file_stream(db: Session, file_path: Path, region_batch_size: int) -> tuple[int, int]:
+    """
+    Insert a JSON scan file while reading it, with its regions inserted in batches as they are
+    decoded and a single commit once the whole scan is inserted. The scan is skipped if it was
+    already inserted with the same content, and replaced if its content changed. Return the number
+    of inserted and skipped scans. A file that cannot be read is reported and ignored.
+    """
+
+    print(f"Loading scan data from '{file_path}'...")
+
+    try:
+        # Hash the scan in a first pass, as the hash is needed before inserting anything.
+        with trace_span('hash_scan'):
+            content_hash = hash_scan_file_stream(file_path)
+
+        with open(file_path) as file:
+            metadata, regions = read_scan_json_stream(file)
+
+            inserted_hashes = select_scan_hashes(db, [metadata.file_name])
+            if metadata.file_name not in inserted_hashes:
+                print(f"Inserting scan '{metadata.file_name}'.")
+            elif inserted_hashes[metadata.file_name] != content_hash:
+                print(f"Replacing scan '{metadata.file_name}'.")
+                delete_scans(db, [metadata.file_name])
+            else:
+                print(f"Scan '{metadata.file_name}' is already inserted, skipping it.")
+                return 0, 1
+
+            scan_id, = insert_scan_records(db, [metadata], [content_hash])
+
+            region_count = 0
+            for batch in batched(regions, region_batch_size):
+                with trace_span('insert_scan_regions', regions=len(batch)):
+                    insert_scan_regions(db, [(scan_id, region) for region in batch])
+
+                region_count += len(batch)
+
+        update_region_aggregates(db, [scan_id])
+
+        with trace_span('commit'):
+            db.commit()
+    except Exception as error:
+        db.rollback()
+        print_warning(f"Could not insert scan file '{file_path}': {error}")
+        return 0, 0
+
+    print(f"Inserted scan '{metadata.file_name}' ({region_count} regions).")
+    return 1, 0
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(
-        description='Insert a scan JSON into the database.'
+        description='Insert scan JSONs into the database.'
+    )
+
+    parser.add_argument(
+        'files',
+        type=Path,
+        nargs='*',
+        help="JSON, JSON lines or NPZ files containing the scan data, or directories containing such files. If"
+            " not provided, read a JSON scan from the standard input."
+    )
+
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=16,
+        help="The number of scans inserted in each transaction."
+    )
+
+    parser.add_argument(
+        '--region-batch-size',
+        type=int,
+        default=64,
+        help="The number of regions inserted at once for the JSON files, which are read and inserted"
+            " incrementally with one transaction per scan."
     )
 
     parser.add_argument(
-        'file',
+        '--profile',
         type=Path,
-        help='JSON file containing the scan data. If not provided, read from the standard input.'
+        help="Write a JSON trace of the wall time, CPU time and peak memory of each stage in a file."
     )
 
     args = parser.parse_args()
 
-    if args.file:
-        if not args.file.exists():
-            print_error_exit(f"File '{args.file}' not found.")
+    if args.profile is not None:
+        start_trace(args.profile)
 
-        with open(args.file) as file:
-            scan = read_scan_json(file)
+    if args.files != []:
+        file_paths = find_scan_files(args.files)
+        stream_paths = [file_path for file_path in file_paths if file_path.suffix == '.json']
+        scans = read_scan_files([file_path for file_path in file_paths if file_path.suffix != '.json'])
     else:
-        scan = read_scan_json(sys.stdin)
+        stream_paths = []
+        print("Loading scan data...")
+        scan = read_scan_json(sys.stdin.read())
+        scans = iter([(scan, hash_scan(scan))])
 
-    print(f"Loaded scan: {scan.file_name}")
-    print(f"Number of regions: {len(scan.regions)}")
+    inserted_count = 0
+    skipped_count  = 0
 
-    db = Session(get_engine())
+    with Session(get_engine()) as db:
+        for file_path in stream_paths:
+            with trace_span('insert_scan_file_stream', file=file_path.name):
+                file_inserted_count, file_skipped_count = insert_scan_file_stream(db, file_path, args.region_batch_size)
 
-    if select_scan(db, scan.file_name) is not None:
-        print_error_exit(f"Scan '{scan.file_name}' is already inserted in the database.")
+            inserted_count += file_inserted_count
+            skipped_count  += file_skipped_count
 
-    print("Inserting scan into database...")
+        for batch in batched(scans, args.batch_size):
+            with trace_span('insert_scan_batch', scans=len(batch)):
+                batch_inserted_count, batch_skipped_count = insert_scan_batch(db, list(batch))
 
-    db_scan = insert_scan(db, scan)
+            inserted_count += batch_inserted_count
+            skipped_count  += batch_skipped_count
 
-    print(f"Successfully inserted scan with ID: {db_scan.id}")
+    print(f"Successfully inserted {inserted_count} scans, skipped {skipped_count} unchanged scans.")
 
 
 if __name__ == '__main__':
@@ -8,11 +8,24 @@ import nibabel as nib
 import numpy as np
 from nibabel.nifti1 import Nifti1Image
 
-from brain_region_database.nifti import ants_to_nib, load_nifti_image
+from brain_region_database.nifti import ants_to_nib, get_nifti_data, load_nifti_image
 from brain_region_database.process.orientation import reorient_nifti
-from brain_region_database.process.registration import register_nifti
+from brain_region_database.process.registration import (
+    DEFAULT_REGISTRATION_CACHE_SIZE,
+    RegistrationCache,
+    register_nifti,
+)
 from brain_region_database.process.size import resize_nifti
 from brain_region_database.process.spatialization import respatialize_nifti
+from brain_region_database.process.transform import (
+    GridTransform,
+    create_reference_transform,
+    create_resize_transform,
+    get_image_grid,
+    get_interpolation_order,
+    resample_nifti,
+)
+from brain_region_database.profiling import start_trace, trace_span
 from brain_region_database.util import print_error_exit
 
 
@@ -34,6 +47,15 @@ def main() -> None:
         action='store_true',
         help="Register the image.")
 
+    parser.add_argument('--registration-cache',
+        type=Path,
+        help="A directory in which to cache the registration transforms.")
+
+    parser.add_argument('--registration-cache-size',
+        type=float,
+        default=DEFAULT_REGISTRATION_CACHE_SIZE / 1024 ** 3,
+        help="The maximum size of the registration cache in gigabytes.")
+
     parser.add_argument('--respatialize',
         action='store_true',
         help="Respatialize the image.")
@@ -46,11 +68,22 @@ def main() -> None:
         action='store_true',
         help="Resize the image.")
 
+    parser.add_argument('--single-pass',
+        action='store_true',
+        help="Resample the image once for all the respatialization, reorientation and resizing steps and the data"
+            " type conversion, instead of once per step. The interpolation and anti-aliasing differ slightly from"
+            " the separate steps.")
+
     parser.add_argument('--interpolation',
         choices=['nearest', 'continuous'],
         default='continuous',
         help="The interpolation to use in resampling.")
 
+    parser.add_argument('--jobs',
+        type=int,
+        default=1,
+        help="The number of threads used to reorient or resample the image.")
+
     parser.add_argument('--reference',
         type=Path,
         help="The reference NIfTI image against which to resize or reorient the image.")
@@ -60,8 +93,15 @@ def main() -> None:
         type=Path,
         help="The file or directory name for the output NIfTI image.")
 
+    parser.add_argument('--profile',
+        type=Path,
+        help="Write a JSON trace of the wall time, CPU time and peak memory of each stage in a file.")
+
     args = parser.parse_args()
 
+    if args.profile is not None:
+        start_trace(args.profile)
+
     scan_path   = args.scan
     output_path = args.output
     scan_image = load_nifti_image(scan_path)
@@ -78,53 +118,94 @@ def main() -> None:
         scan_image      = ants.image_read(str(args.scan))  # type: ignore
         reference_image = ants.image_read(str(args.reference))  # type: ignore
 
+        if args.registration_cache is not None:
+            registration_cache = RegistrationCache(
+                args.registration_cache,
+                int(args.registration_cache_size * 1024 ** 3),
+            )
+        else:
+            registration_cache = None
+
         print("Registering image...")
 
-        registered_image = register_nifti(scan_image, reference_image, args.interpolation)  # type: ignore
-        scan_image = ants_to_nib(registered_image)
+        with trace_span('register_nifti'):
+            registered_image = register_nifti(  # type: ignore
+                scan_image,
+                reference_image,
+                args.interpolation,
+                registration_cache,
+            )
+            scan_image = ants_to_nib(registered_image)
 
     if args.reference is not None:
         reference_image = load_nifti_image(args.reference)
     else:
         reference_image = None
 
-    if args.respatialize:
-        if reference_image is None:
-            return print_error_exit("A reference image is needed to perform respatialization.")
-
-        print("Respatializing image...")
-
-        scan_image = respatialize_nifti(scan_image, reference_image, args.interpolation)
+    steps: list[str] = [step for step in ('respatialize', 'reorient', 'resize') if getattr(args, step)]
+    target_type = getattr(np, args.type) if args.type else None
 
-    if args.reorient:
+    if steps != []:
         if reference_image is None:
-            return print_error_exit("A reference image is needed to perform reorientation.")
+            return print_error_exit(
+                "A reference image is needed to perform respatialization, reorientation, or resizing."
+            )
 
-        print("Reorienting image...")
+        # Chain the resampling steps and the type conversion in a single pass if requested. The result
+        # differs slightly from the separate steps, which remain the default.
+        if args.single_pass:
+            print(f"Resampling image ({', '.join(steps)}) in a single pass...")
+
+            grid = get_image_grid(scan_image)
+            transforms: list[GridTransform] = []
+            for step in steps:
+                if step == 'resize':
+                    transform = create_resize_transform(grid, reference_image)
+                else:
+                    transform = create_reference_transform(grid, reference_image)
+
+                transforms.append(transform)
+                grid = transform.grid
+
+            order = get_interpolation_order(args.interpolation, 'respatialize' in steps)
+            with trace_span('resample_nifti', steps=steps):
+                scan_image = resample_nifti(scan_image, transforms, order, target_type, args.jobs)
+            target_type = None
+        else:
+            if args.respatialize:
+                print("Respatializing image...")
 
-        scan_image = reorient_nifti(scan_image, reference_image, args.interpolation)
+                with trace_span('respatialize_nifti'):
+                    scan_image = respatialize_nifti(scan_image, reference_image, args.interpolation)
 
-    if args.resize:
-        if reference_image is None:
-            return print_error_exit("A reference image is needed to perform resizing.")
+            if args.reorient:
+                print("Reorienting image...")
+
+                with trace_span('reorient_nifti'):
+                    scan_image = reorient_nifti(scan_image, reference_image, args.interpolation, args.jobs)
 
-        print("Resizing image...")
+            if args.resize:
+                print("Resizing image...")
 
-        scan_image = resize_nifti(scan_image, reference_image, args.interpolation)
+                with trace_span('resize_nifti'):
+                    scan_image = resize_nifti(scan_image, reference_image, args.interpolation)
 
-    if args.type:
-        current_type = scan_image.get_fdata().dtype
-        target_type = getattr(np, args.type)
+    if target_type is not None:
+        # Compare the type of the data rather than of the header, which the resampling steps keep from
+        # the reference image while their data is floating point.
+        current_type = get_nifti_data(scan_image).dtype
 
         if current_type != target_type:
             print(f"Converting image from {current_type} to {args.type}...")
-            data = scan_image.get_fdata().astype(target_type)  # type: ignore
-            scan_image = Nifti1Image(data, scan_image.affine, scan_image.header)  # type: ignore
-            scan_image.header.set_data_dtype(target_type)  # type: ignore
+            with trace_span('convert_type'):
+                data = get_nifti_data(scan_image).astype(target_type)  # type: ignore
+                scan_image = Nifti1Image(data, scan_image.affine, scan_image.header)  # type: ignore
+                scan_image.header.set_data_dtype(target_type)  # type: ignore
         else:
             print(f"Image already uses the '{target_type}' data type. No conversion needed.")
 
-    nib.save(scan_image, get_full_output_path(output_path, scan_path.name))  # type: ignore
+    with trace_span('save'):
+        nib.save(scan_image, get_full_output_path(output_path, scan_path.name))  # type: ignore
 
     print("Success!")
 
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+import argparse
+from pathlib import Path
+
+from sqlalchemy.orm import Session
+
+from brain_region_database.database.aggregate import rebuild_region_aggregates
+from brain_region_database.database.engine import get_engine
+from brain_region_database.profiling import start_trace, trace_span
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Rebuild the region aggregates from the scan regions of the database."
+    )
+
+    parser.add_argument(
+        'regions',
+        nargs='*',
+        help="The names of the regions whose aggregates to rebuild. If not provided, rebuild all the aggregates."
+    )
+
+    parser.add_argument(
+        '--profile',
+        type=Path,
+        help="Write a JSON trace of the wall time, CPU time and peak memory of each stage in a file."
+    )
+
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        start_trace(args.profile)
+
+    with Session(get_engine()) as db:
+        print("Rebuilding region aggregates...")
+        with trace_span('rebuild_region_aggregates'):
+            rebuild_region_aggregates(db, args.regions if args.regions != [] else None)
+
+        with trace_span('commit'):
+            db.commit()
+
+    print("Success!")
+
+
+if __name__ == '__main__':
+    main()
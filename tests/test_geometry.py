@@ -0,0 +1,102 @@
+import re
+import struct
+
+import numpy as np
+import pytest
+
+from brain_region_database.database.geometry import (
+    WKB_POINT,
+    WKB_POLYGON,
+    WKB_POLYHEDRALSURFACE,
+    WKB_SRID_FLAG,
+    WKB_Z_FLAG,
+    create_point_ewkb,
+    create_polyhedral_surface_ewkb,
+)
+from brain_region_database.database.query import create_point, create_postgis_3d_geometry
+from brain_region_database.scan import Point3D
+
+type Polygon = list[list[tuple[float, float, float]]]
+
+
+class EwkbReader:
+    """
+    Minimal reader of the extended WKB geometries written by the encoder.
+    """
+
+    def __init__(self, data: bytes):
+        self.data     = data
+        self.position = 0
+
+    def read(self, format: str) -> tuple:
+        values = struct.unpack_from(format, self.data, self.position)
+        self.position += struct.calcsize(format)
+        return values
+
+    def read_type(self) -> int:
+        byte_order, geometry_type = self.read('<BI')
+        assert byte_order == 1
+        return geometry_type
+
+    def read_point(self) -> tuple[float, float, float]:
+        return self.read('<3d')
+
+    def read_polygon(self) -> Polygon:
+        assert self.read_type() == WKB_POLYGON | WKB_Z_FLAG
+        ring_count, = self.read('<I')
+        rings = []
+        for _ in range(ring_count):
+            point_count, = self.read('<I')
+            rings.append([self.read_point() for _ in range(point_count)])
+
+        return rings
+
+    def read_root(self, geometry_type: int) -> int:
+        assert self.read_type() == geometry_type | WKB_Z_FLAG | WKB_SRID_FLAG
+        srid, = self.read('<I')
+        return srid
+
+
+def parse_point_wkt(text: str) -> tuple[float, float, float]:
+    match = re.fullmatch(r'POINT Z\((\S+) (\S+) (\S+)\)', text)
+    assert match is not None
+    return tuple(float(value) for value in match.groups())  # type: ignore
+
+
+def parse_polyhedral_surface_wkt(text: str) -> list[Polygon]:
+    assert text.startswith('POLYHEDRALSURFACE Z (')
+    return [
+        [[tuple(float(value) for value in point.split()) for point in ring.split(',')]]  # type: ignore
+        for ring in re.findall(r'\(\(([^()]*)\)\)', text)
+    ]
+
+
+def decode_polyhedral_surface(ewkb: bytes) -> tuple[int, list[Polygon]]:
+    reader = EwkbReader(ewkb)
+    srid = reader.read_root(WKB_POLYHEDRALSURFACE)
+    polygon_count, = reader.read('<I')
+    polygons = [reader.read_polygon() for _ in range(polygon_count)]
+    assert reader.position == len(ewkb)
+    return srid, polygons
+
+
+def test_point_ewkb():
+    point = Point3D(x=-12.5, y=0.1, z=1e-7)
+
+    reader = EwkbReader(create_point_ewkb(point))
+    assert reader.read_root(WKB_POINT) == 4326
+    assert reader.read_point() == parse_point_wkt(create_point(point))
+    assert reader.position == len(reader.data)
+
+
+@pytest.mark.parametrize('face_count', [0, 1, 50])
+def test_polyhedral_surface_ewkb(face_count: int):
+    rng = np.random.default_rng(face_count)
+    vertices = rng.normal(scale=50, size=(max(face_count, 3), 3))
+    faces    = rng.integers(0, len(vertices), size=(face_count, 3))
+
+    srid, polygons = decode_polyhedral_surface(create_polyhedral_surface_ewkb(vertices, faces))
+
+    assert srid == 4326
+    assert len(polygons) == face_count
+    assert polygons == parse_polyhedral_surface_wkt(create_postgis_3d_geometry(vertices.tolist(), faces.tolist()))
@@ -0,0 +1,45 @@
+import io
+import json
+from typing import Any
+
+import pytest
+
+from brain_region_database.json_stream import JsonStream
+
+DOCUMENT = json.dumps({
+    'name': 'scan "A"\nwith escapes é',
+    'size': 1024,
+    'values': [1.5, 2.25e-3, 0.125, -7, 1e10, -0.0, 123456789.125],
+    'flags': [True, False, None],
+    'nested': {'empty_array': [], 'empty_object': {}, 'deep': [[1, [2.5]], {'x': -3.75e-5}]},
+}, indent=2)
+
+
+def read_stream_document(stream: JsonStream) -> dict[str, Any]:
+    """
+    Read a JSON object member by member, iterating over the values of its arrays.
+    """
+
+    return {
+        key: list(stream.iter_array()) if stream.peek() == '[' else stream.read_value()
+        for key in stream.iter_object()
+    }
+
+
+@pytest.mark.parametrize('chunk_size', range(1, 40))
+def test_read_value_chunk_boundaries(chunk_size: int):
+    stream = JsonStream(io.StringIO(DOCUMENT), chunk_size=chunk_size)
+    assert read_stream_document(stream) == json.loads(DOCUMENT)
+
+
+@pytest.mark.parametrize('chunk_size', range(1, 12))
+def test_iter_array_numbers(chunk_size: int):
+    stream = JsonStream(io.StringIO('[1.5, 2.25e-3, 0.125]'), chunk_size=chunk_size)
+    assert list(stream.iter_array()) == [1.5, 2.25e-3, 0.125]
+
+
+@pytest.mark.parametrize('document', ['12.5', ' -3e2 ', '[]', '{}'])
+def test_read_value_end_of_file(document: str):
+    for chunk_size in range(1, len(document) + 2):
+        stream = JsonStream(io.StringIO(document), chunk_size=chunk_size)
+        assert stream.read_value() == json.loads(document)
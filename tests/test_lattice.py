@@ -0,0 +1,116 @@
+import io
+import json
+from pathlib import Path
+
+import numpy as np
+from nibabel.nifti1 import Nifti1Image
+from test_nifti import create_oblique_image
+from test_scan import create_scan
+
+from brain_region_database.lattice import apply_affine, decode_lattice_mesh, encode_lattice_mesh
+from brain_region_database.process.vectorization import compute_mesh_lattice, compute_nifti_mask_mesh
+from brain_region_database.scan import (
+    Scan,
+    ScanRegion,
+    hash_scan,
+    hash_scan_stream,
+    read_scan,
+    read_scan_json_stream,
+    write_scan,
+)
+
+# Oblique affine of a half-voxel lattice, with anisotropic voxels.
+LATTICE = np.array([
+    [0.46875, 0.05, 0.0, -90.25],
+    [-0.03, 0.6, 0.02, -126.5],
+    [0.0, 0.01, 0.625, -72.125],
+    [0.0, 0.0, 0.0, 1.0],
+])
+
+
+def create_lattice_mesh(vertex_count: int, face_count: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    coordinates = rng.integers(100, 400, size=(vertex_count, 3))
+    return apply_affine(LATTICE, coordinates), rng.integers(0, vertex_count, size=(face_count, 3))
+
+
+def assert_meshes_equal(mesh: tuple[np.ndarray, np.ndarray], expected: tuple[np.ndarray, np.ndarray]):
+    assert np.allclose(mesh[0], expected[0])
+    assert np.array_equal(mesh[1], expected[1])
+
+
+def test_encode_lattice_mesh():
+    for vertex_count, face_count in ((1, 1), (12, 20), (70000, 140000)):
+        vertices, faces = create_lattice_mesh(vertex_count, face_count)
+
+        encoded = encode_lattice_mesh(vertices, faces, LATTICE)
+        assert encoded is not None
+        assert_meshes_equal(decode_lattice_mesh(encoded, LATTICE), (vertices, faces))
+
+
+def test_encode_lattice_mesh_off_lattice():
+    vertices, faces = create_lattice_mesh(12, 20)
+    vertices[5] += [0.1, 0.0, 0.0]
+
+    assert encode_lattice_mesh(vertices, faces, LATTICE) is None
+    assert encode_lattice_mesh(np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64), LATTICE) is None
+
+
+def test_encode_lattice_mesh_marching_cubes():
+    # Labels of an ellipsoid and of a box touching the border of the volume, with oblique voxels.
+    coordinates = np.mgrid[:24, :20, :12]
+    labels = np.zeros((24, 20, 12), dtype=np.int16)
+    labels[np.sum(((coordinates.T - [11, 9, 6]) / [8, 6, 4]) ** 2, axis=-1).T < 1] = 1
+    labels[18:, 14:, 6:] = 2
+
+    image = Nifti1Image(labels, create_oblique_image().affine)
+    lattice = compute_mesh_lattice(image)
+
+    for value in (1, 2):
+        voxels = np.argwhere(labels == value)
+        vertices, faces = compute_nifti_mask_mesh(image, labels, value, (voxels.min(axis=0), voxels.max(axis=0)))
+
+        encoded = encode_lattice_mesh(vertices, faces, lattice)
+        assert encoded is not None
+        assert_meshes_equal(decode_lattice_mesh(encoded, lattice), (vertices, faces))
+
+
+def test_scan_json_lattice():
+    off_lattice = create_lattice_mesh(12, 20, seed=1)
+    off_lattice[0][3] += [0.0, 0.2, 0.0]
+    scan = create_scan(meshes=[create_lattice_mesh(12, 20), off_lattice], lattice=LATTICE)
+
+    data = json.loads(scan.model_dump_json())
+    assert data['lattice'] == LATTICE.tolist()
+    assert isinstance(data['regions'][0]['shape'], dict)
+    # The mesh that is not on the lattice falls back to lists of coordinates.
+    assert isinstance(data['regions'][1]['shape'], list)
+    assert list(data['regions'][0]) == list(ScanRegion.model_fields)
+
+    decoded = Scan.model_validate_json(scan.model_dump_json())
+    for region, expected in zip(decoded.regions, scan.regions, strict=True):
+        assert_meshes_equal(region.shape, expected.shape)
+
+
+def test_scan_formats_lattice(tmp_path: Path):
+    scan = create_scan(meshes=[create_lattice_mesh(12, 20, seed) for seed in range(3)], lattice=LATTICE)
+
+    for file_name in ('scan.json', 'scan.npz'):
+        write_scan(scan, tmp_path / file_name)
+        decoded = read_scan(tmp_path / file_name)
+
+        assert decoded.lattice is not None and np.array_equal(decoded.lattice, LATTICE)
+        for region, expected in zip(decoded.regions, scan.regions, strict=True):
+            assert_meshes_equal(region.shape, expected.shape)
+
+
+def test_hash_scan_stream_lattice():
+    for region_count in (0, 1, 3):
+        scan = create_scan(
+            meshes=[create_lattice_mesh(12, 20, seed) for seed in range(region_count)],
+            lattice=LATTICE,
+        )
+        document = scan.model_dump_json(indent=4)
+
+        metadata, regions = read_scan_json_stream(io.StringIO(document))
+        assert hash_scan_stream(metadata, regions) == hash_scan(Scan.model_validate_json(document))
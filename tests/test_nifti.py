@@ -0,0 +1,49 @@
+import numpy as np
+from nibabel.nifti1 import Nifti1Image
+
+from brain_region_database.nifti import RAS_TO_LPS, ants_to_nib, nib_to_ants
+
+
+def create_oblique_image() -> Nifti1Image:
+    rotation_x, rotation_z = np.deg2rad(12), np.deg2rad(-20)
+    rotation = np.array([
+        [np.cos(rotation_z), -np.sin(rotation_z), 0],
+        [np.sin(rotation_z),  np.cos(rotation_z), 0],
+        [0, 0, 1],
+    ]) @ np.array([
+        [1, 0, 0],
+        [0, np.cos(rotation_x), -np.sin(rotation_x)],
+        [0, np.sin(rotation_x),  np.cos(rotation_x)],
+    ])
+
+    affine = np.eye(4)
+    affine[:3, :3] = rotation @ np.diag([0.9, 1.2, 2.5])
+    affine[:3, 3]  = [-91.5, 17.25, -64.0]
+
+    data = np.random.default_rng(0).random((7, 9, 5)).astype(np.float32)
+    return Nifti1Image(data, affine)
+
+
+def test_nib_to_ants_geometry():
+    image = create_oblique_image()
+    ants_image = nib_to_ants(image)
+
+    spacing   = np.array(ants_image.spacing)
+    direction = np.array(ants_image.direction)
+    origin    = np.array(ants_image.origin)
+
+    lps_affine = RAS_TO_LPS @ image.affine[:3, :]
+
+    assert np.allclose(spacing, [0.9, 1.2, 2.5])
+    assert np.allclose(direction @ np.diag(spacing), lps_affine[:, :3])
+    assert np.allclose(origin, lps_affine[:, 3])
+    assert np.array_equal(ants_image.numpy(), image.get_fdata(dtype=np.float32))
+
+
+def test_ants_to_nib_round_trip():
+    image = create_oblique_image()
+    round_trip = ants_to_nib(nib_to_ants(image))
+
+    assert np.allclose(round_trip.affine, image.affine)
+    assert np.allclose(round_trip.header.get_zooms(), [0.9, 1.2, 2.5])
+    assert np.array_equal(round_trip.get_fdata(dtype=np.float32), image.get_fdata(dtype=np.float32))
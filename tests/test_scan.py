@@ -0,0 +1,111 @@
+import io
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from brain_region_database.scan import (
+    Point3D,
+    Scan,
+    ScanRegion,
+    ScanRegionLevel,
+    hash_scan,
+    hash_scan_stream,
+    read_scan,
+    read_scan_json_stream,
+    validate_mesh_array,
+    write_scan,
+)
+
+
+def create_scan(
+    region_count: int = 3,
+    meshes: list[tuple[np.ndarray, np.ndarray]] | None = None,
+    lattice: np.ndarray | None = None,
+) -> Scan:
+    """
+    Create a scan with random meshes, or the given ones, and simplified levels.
+    """
+
+    rng = np.random.default_rng(0)
+    origin = Point3D(x=0, y=0, z=0)
+
+    if meshes is None:
+        meshes = [(rng.normal(size=(12, 3)), rng.integers(0, 12, size=(20, 3))) for _ in range(region_count)]
+
+    return Scan(
+        file_name='scan.nii',
+        file_size=1024,
+        dimensions='10x10x10',
+        voxel_size='1.00x1.00x1.00mm',
+        lattice=lattice,
+        regions=[
+            ScanRegion(
+                name=f'region {i}',
+                value=i + 1,
+                voxel_count=10 * (i + 1),
+                mean_intensity=0.5,
+                std_intensity=0.1,
+                min_intensity=0.0,
+                max_intensity=1.0,
+                median_intensity=0.5,
+                centroid=origin,
+                bounding_box=(origin, Point3D(x=1, y=1, z=1)),
+                shape=mesh,
+                levels=[ScanRegionLevel(ratio=0.25, shape=(rng.normal(size=(4, 3)), rng.integers(0, 4, size=(5, 3))))],
+            )
+            for i, mesh in enumerate(meshes)
+        ],
+    )
+
+
+def test_hash_scan_stream():
+    for region_count in (0, 1, 3):
+        scan = create_scan(region_count)
+        metadata, regions = read_scan_json_stream(io.StringIO(scan.model_dump_json(indent=4)))
+        assert hash_scan_stream(metadata, regions) == hash_scan(scan)
+
+
+def test_hash_scan_formats(tmp_path: Path):
+    scan = create_scan()
+
+    for file_name in ('scan.json', 'scan.npz'):
+        write_scan(scan, tmp_path / file_name)
+        assert hash_scan(read_scan(tmp_path / file_name)) == hash_scan(scan)
+
+
+def test_validate_mesh_array():
+    vertices = np.zeros((4, 3), dtype=np.float64)
+    assert validate_mesh_array(vertices, np.float64) is vertices
+    assert validate_mesh_array(np.zeros((4, 3), dtype=np.int32), np.float64).dtype == np.float64
+
+    faces = np.zeros((4, 3), dtype=np.int64)
+    assert validate_mesh_array(faces, np.int64) is faces
+
+    for value in ([], np.zeros((0,)), np.zeros((0, 3), dtype=np.float32)):
+        empty = validate_mesh_array(value, np.int64)
+        assert empty.shape == (0, 3) and empty.dtype == np.int64
+
+    with pytest.raises(ValueError, match='shape'):
+        validate_mesh_array(np.zeros((4, 2)), np.float64)
+
+    with pytest.raises(ValueError, match='shape'):
+        validate_mesh_array(np.zeros(12), np.float64)
+
+    with pytest.raises(ValueError, match='cannot be converted'):
+        validate_mesh_array(np.zeros((4, 3), dtype=np.float64), np.int64)
+
+    with pytest.raises(ValueError, match='cannot be converted'):
+        validate_mesh_array([['a', 'b', 'c']], np.float64)
+
+
+def test_scan_equality():
+    scan = create_scan()
+    assert scan == scan.model_copy(deep=True)
+    assert scan.regions[0] == scan.regions[0].model_copy(deep=True)
+    assert scan.regions[0].levels[0] == scan.regions[0].levels[0].model_copy(deep=True)
+    assert scan.regions[0] != scan.regions[1]
+
+    other = scan.model_copy(deep=True)
+    other.regions[2].shape[0][0, 0] += 1.0
+    assert scan != other